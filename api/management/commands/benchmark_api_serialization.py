@@ -0,0 +1,65 @@
+import time
+
+from django.core.management.base import BaseCommand, no_translations
+from rest_framework import serializers
+
+from api.serializers import RecipeSerializer
+from recipes.models import Recipe
+
+
+class RecipeModelSerializer(serializers.ModelSerializer):
+    """
+    The same recipe fields with a plain ModelSerializer
+    """
+    tags = serializers.SlugRelatedField(
+        source='tag', slug_field='slug', many=True, read_only=True
+    )
+
+    class Meta:
+        model = Recipe
+        fields = ('id', 'name', 'author', 'description', 'cook_time',
+                  'pub_date', 'image', 'favorites_count', 'purchases_count',
+                  'tags')
+
+
+def _values(queryset):
+    serializer = RecipeSerializer()
+    return serializer.serialize(serializer.get_values(queryset))
+
+
+def _model_serializer(queryset):
+    return RecipeModelSerializer(
+        queryset.prefetch_related('tag'), many=True
+    ).data
+
+
+class Command(BaseCommand):
+    help = 'Compare the .values() and ModelSerializer recipe serialization'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    @no_translations
+    def handle(self, *args, **options):
+        """
+        python manage.py benchmark_api_serialization
+        Serializes the latest --limit recipes --repeat times each way,
+        the database reads are included in the timings.
+        """
+        queryset = Recipe.recipes.all()[:options['limit']]
+        rows = queryset.count()
+        if not rows:
+            self.stderr.write('There are no recipes to serialize')
+            return
+        for title, serialize in (('values', _values),
+                                 ('ModelSerializer', _model_serializer)):
+            start = time.perf_counter()
+            for _ in range(options['repeat']):
+                serialize(queryset)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f'{title}: {rows * options["repeat"] / elapsed:.0f} rows/s '
+                f'({elapsed / options["repeat"] * 1000:.1f} ms '
+                f'per {rows} rows)'
+            )
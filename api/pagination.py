@@ -0,0 +1,9 @@
+from rest_framework.pagination import LimitOffsetPagination
+
+
+class ValuesPagination(LimitOffsetPagination):
+    """
+    ?limit= is capped, a single request cannot read the whole table
+    """
+
+    max_limit = 100
@@ -0,0 +1,117 @@
+from collections import defaultdict
+
+from django.core.files.storage import default_storage
+from rest_framework.exceptions import ValidationError
+
+from recipes.models import Amount, Recipe
+
+
+def _image_url(name):
+    return default_storage.url(name) if name else None
+
+
+class ValuesSerializer:
+    """
+    Serializes a queryset read with .values(): the rows are plain dicts
+    straight from the database and no model instances are built.
+    fields maps the output names to the lookups, many_fields and includes
+    name the to-many fields loaded for a whole page by get_<name>(ids).
+    The id is always returned, the other fields can be narrowed by fields=.
+    """
+
+    fields = {}
+    many_fields = ()
+    includes = ()
+    converters = {}
+
+    def __init__(self, fields=(), include=()):
+        names = list(dict.fromkeys(fields)) or [
+            *self.fields, *self.many_fields
+        ]
+        unknown = set(names) - set(self.fields) - set(self.many_fields)
+        if unknown:
+            raise ValidationError({'fields': 'Неизвестные поля: '
+                                   + ', '.join(sorted(unknown))})
+        unknown = set(include) - set(self.includes)
+        if unknown:
+            raise ValidationError({'include': 'Неизвестные связи: '
+                                   + ', '.join(sorted(unknown))})
+        self.field_names = ['id'] + [
+            name for name in names if name in self.fields and name != 'id'
+        ]
+        self.loaded = [name for name in names if name in self.many_fields]
+        self.loaded += [name for name in include if name not in self.loaded]
+
+    def get_values(self, queryset):
+        return queryset.values(*{self.fields[name]
+                                 for name in self.field_names})
+
+    def serialize(self, rows):
+        data = [
+            {name: row[self.fields[name]] for name in self.field_names}
+            for row in rows
+        ]
+        for name, convert in self.converters.items():
+            if name in self.field_names:
+                for item in data:
+                    item[name] = convert(item[name])
+        ids = [item['id'] for item in data]
+        for name in self.loaded:
+            values = getattr(self, f'get_{name}')(ids) if ids else {}
+            for item in data:
+                item[name] = values.get(item['id'], [])
+        return data
+
+
+class RecipeSerializer(ValuesSerializer):
+    fields = {
+        'id': 'id',
+        'name': 'name',
+        'author': 'author_id',
+        'description': 'description',
+        'cook_time': 'cook_time',
+        'pub_date': 'pub_date',
+        'image': 'image',
+        'favorites_count': 'favorites_count',
+        'purchases_count': 'purchases_count',
+    }
+    many_fields = ('tags',)
+    includes = ('ingredients',)
+    converters = {'image': _image_url}
+
+    def get_tags(self, ids):
+        tags = defaultdict(list)
+        links = Recipe.tag.through.objects.filter(
+            recipe_id__in=ids
+        ).order_by('tag_id').values_list('recipe_id', 'tag__slug')
+        for recipe_id, slug in links:
+            tags[recipe_id].append(slug)
+        return tags
+
+    def get_ingredients(self, ids):
+        ingredients = defaultdict(list)
+        amounts = Amount.objects.filter(recipe_id__in=ids).order_by(
+            'pk').values_list('recipe_id', 'ingredient__name',
+                              'ingredient__unit', 'units')
+        for recipe_id, name, unit, units in amounts:
+            ingredients[recipe_id].append(
+                {'name': name, 'unit': unit, 'amount': units}
+            )
+        return ingredients
+
+
+class TagSerializer(ValuesSerializer):
+    fields = {'id': 'id', 'name': 'name', 'slug': 'slug'}
+
+
+class IngredientSerializer(ValuesSerializer):
+    fields = {'id': 'id', 'name': 'name', 'unit': 'unit'}
+
+
+class AuthorSerializer(ValuesSerializer):
+    fields = {
+        'id': 'id',
+        'username': 'username',
+        'first_name': 'first_name',
+        'last_name': 'last_name',
+    }
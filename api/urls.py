@@ -0,0 +1,15 @@
+from django.urls import include, path
+from rest_framework.routers import SimpleRouter
+
+from api.views import (AuthorViewSet, IngredientViewSet, RecipeViewSet,
+                       TagViewSet)
+
+router_v1 = SimpleRouter()
+router_v1.register('recipes', RecipeViewSet, basename='recipes')
+router_v1.register('tags', TagViewSet, basename='tags')
+router_v1.register('ingredients', IngredientViewSet, basename='ingredients')
+router_v1.register('authors', AuthorViewSet, basename='authors')
+
+urlpatterns = [
+    path('v1/', include(router_v1.urls)),
+]
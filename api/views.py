@@ -0,0 +1,92 @@
+from django.db.models import Exists, OuterRef
+from rest_framework.exceptions import NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.viewsets import GenericViewSet
+
+from recipes.models import Ingredient, Recipe, Tag, User
+from recipes.util import get_filters
+
+from .pagination import ValuesPagination
+from .serializers import (AuthorSerializer, IngredientSerializer,
+                          RecipeSerializer, TagSerializer)
+
+
+def _split(value):
+    return [part for part in value.split(',') if part]
+
+
+class ValuesViewSet(GenericViewSet):
+    """
+    Read-only list and detail of a resource serialized with .values().
+    ?fields=a,b narrows the fields, ?include=x adds the related rows.
+    """
+
+    renderer_classes = [JSONRenderer]
+    pagination_class = ValuesPagination
+    values_serializer_class = None
+    lookup_value_regex = r'\d+'
+
+    def get_values_serializer(self):
+        params = self.request.query_params
+        return self.values_serializer_class(
+            _split(params.get('fields', '')), _split(params.get('include', ''))
+        )
+
+    def list(self, request):
+        serializer = self.get_values_serializer()
+        rows = serializer.get_values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(serializer.serialize(page))
+        return Response(serializer.serialize(rows))
+
+    def retrieve(self, request, pk):
+        serializer = self.get_values_serializer()
+        data = serializer.serialize(
+            serializer.get_values(self.get_queryset().filter(pk=pk))
+        )
+        if not data:
+            raise NotFound('Объект не найден')
+        return Response(data[0])
+
+
+class RecipeViewSet(ValuesViewSet):
+    """
+    Recipes, newest first.
+    ?filters=<slug> selects the recipes having one of the tags
+    like on the site pages, ?author=<id> the recipes of an author.
+    """
+
+    values_serializer_class = RecipeSerializer
+
+    def get_queryset(self):
+        queryset = Recipe.recipes.all()
+        author = self.request.query_params.get('author')
+        if author and author.isdigit():
+            queryset = queryset.filter(author_id=author)
+        return get_filters(self.request, queryset)
+
+
+class TagViewSet(ValuesViewSet):
+    values_serializer_class = TagSerializer
+    pagination_class = None
+    queryset = Tag.objects.order_by('pk')
+
+
+class IngredientViewSet(ValuesViewSet):
+    values_serializer_class = IngredientSerializer
+    queryset = Ingredient.objects.order_by('name', 'pk')
+
+
+class AuthorViewSet(ValuesViewSet):
+    """
+    Users having at least one recipe
+    """
+
+    values_serializer_class = AuthorSerializer
+
+    def get_queryset(self):
+        return User.objects.filter(
+            Exists(Recipe.recipes.filter(author=OuterRef('pk')))
+        ).order_by('pk')
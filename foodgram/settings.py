@@ -52,6 +52,7 @@ else:
 INSTALLED_APPS = [
     'users',
     'recipes',
+    'api',
     'django.contrib.auth',
     'django.contrib.admin',
     'django.contrib.sites',
@@ -62,6 +63,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'debug_toolbar',
     'sorl.thumbnail',
+    'rest_framework',
 ]
 
 MIDDLEWARE = [
@@ -101,6 +103,69 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
 
+# Cache: local memory by default,
+# django.core.cache.backends.filebased.FileBasedCache is also supported.
+# The page generations, id sets and pending PDF renders live in the cache,
+# with several processes they are only shared by the file-based backend
+# or a cache server, LocMemCache keeps a copy per process
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    }
+}
+
+# Anonymous pages are invalidated by the data changes,
+# the timeout only limits the lifetime of the unused entries
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Favorite, purchased recipe and followed author ids of every user.
+# The views drop them on changes, the timeout bounds the staleness after
+# the changes made elsewhere (admin, cascading deletes).
+ID_SET_TIMEOUT = 60 * 60
+# Shopping list size in the header, updated by the purchase signals
+PURCHASES_COUNT_TIMEOUT = 60 * 60
+
+# Operations accepted by one request of the batch endpoint
+BATCH_MAX_OPERATIONS = 100
+
+# Browsers revalidate the ingredient catalog with the ETag after max-age
+INGREDIENTS_MAX_AGE = 60 * 60
+
+# Threads generating the recipe image variants after an upload
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+
+# The recipes are copied to the feeds of the followers in batches.
+# The feeds read the recipes of the authors with more followers
+# than FEED_PUSH_LIMIT at request time instead.
+FEED_WORKERS = int(os.getenv('FEED_WORKERS', 2))
+FEED_BATCH_SIZE = 1000
+FEED_PUSH_LIMIT = int(os.getenv('FEED_PUSH_LIMIT', 10000))
+# Latest recipes copied to the feed when the user follows an author
+FEED_BACKFILL = 30
+
+# Recipe images are streamed to temporary files and dropped once they
+# grow past the limit, the dimensions are read from the image header
+MAX_IMAGE_UPLOAD_SIZE = 1024 * 1024
+MAX_IMAGE_PIXELS = 40 * 1000 * 1000
+
+# Rows fetched per round trip while streaming the shopping list
+SHOPPING_LIST_CHUNK_SIZE = 500
+
+# The exported shopping lists are cached under a hash of the purchases,
+# the timeout only limits the lifetime of the unused entries
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60 * 24
+EXPORT_WORKERS = int(os.getenv('EXPORT_WORKERS', 2))
+# Seconds a download waits for the PDF before answering 202
+PDF_RENDER_WAIT = 3
+PDF_RENDER_TIMEOUT = 60
+PDF_FONT = os.getenv(
+    'PDF_FONT', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
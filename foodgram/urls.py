@@ -16,6 +16,7 @@ urlpatterns = [
     path("auth/", include("users.urls")),
     path("auth/", include("django.contrib.auth.urls")),
     # apps
+    path('api/', include('api.urls')),
     path('', include('recipes.urls')),
 ]
 
@@ -1,6 +1,38 @@
+from contextlib import contextmanager
+
 from django.contrib import admin
+from django.db import transaction
 
 from .models import Amount, Favorite, Follow, Ingredient, Purchase, Recipe, Tag
+from .util import (bump_card_versions, change_recipe_shopping_lists,
+                   get_recipe_shopping_changes)
+
+
+def bump_amount_recipes(recipe_ids):
+    """
+    The cached shopping lists are keyed by the card versions of the
+    purchased recipes, the amounts edited here change them
+    """
+    bump_card_versions(Recipe.recipes.filter(pk__in=set(recipe_ids)))
+
+
+@contextmanager
+def resync_shopping_lists(recipe_ids):
+    """
+    Takes the recipes out of the shopping lists containing them and puts
+    them back once their amounts are edited
+    """
+    recipe_ids = set(recipe_ids)
+    with transaction.atomic():
+        for recipe_id in recipe_ids:
+            change_recipe_shopping_lists(
+                recipe_id, get_recipe_shopping_changes(recipe_id, sign=-1)
+            )
+        yield
+        for recipe_id in recipe_ids:
+            change_recipe_shopping_lists(
+                recipe_id, get_recipe_shopping_changes(recipe_id)
+            )
 
 
 class IngredientQuantityInline(admin.TabularInline):
@@ -30,12 +62,17 @@ class RecipeAdmin(admin.ModelAdmin):
 
     def count_favorite(self, obj):
         """
-        calculates the number of recipes in your favorites
+        the number of recipes in your favorites
         """
-        count = Favorite.favorite.filter(recipe=obj).count()
-        return count
+        return obj.favorites_count
 
     count_favorite.short_description = 'Количество рецептов в избранном'
+    count_favorite.admin_order_field = 'favorites_count'
+
+    def save_related(self, request, form, formsets, change):
+        with resync_shopping_lists([form.instance.pk]):
+            super().save_related(request, form, formsets, change)
+        bump_amount_recipes([form.instance.pk])
 
 
 @admin.register(Tag)
@@ -66,29 +103,21 @@ class IngredientAmountAdmin(admin.ModelAdmin):
     list_display = ('id', 'ingredient', 'recipe', 'units',)
     search_fields = ('ingredient',)
 
-
-@admin.register(Purchase)
-class PurchaseAdmin(admin.ModelAdmin):
-    """
-    Description of the "Purchase" model fields
-    for the administration site
-    """
-    list_display = ('id', 'user',)
-
-
-@admin.register(Favorite)
-class FavoriteRecipeAdmin(admin.ModelAdmin):
-    """
-    Description of the "Favorite" model fields
-    for the administration site
-    """
-    list_display = ('user', 'recipe')
-
-
-@admin.register(Follow)
-class FollowAdmin(admin.ModelAdmin):
-    """
-       Description of the "Follow" model fields
-       for the administration site
-    """
-    list_display = ('user', 'author')
+    def save_model(self, request, obj, form, change):
+        recipe_ids = {obj.recipe_id}
+        if change:
+            recipe_ids.add(form.initial['recipe'])
+        with resync_shopping_lists(recipe_ids):
+            super().save_model(request, obj, form, change)
+        bump_amount_recipes(recipe_ids)
+
+    def delete_model(self, request, obj):
+        with resync_shopping_lists([obj.recipe_id]):
+            super().delete_model(request, obj)
+        bump_amount_recipes([obj.recipe_id])
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = list(queryset.values_list('recipe_id', flat=True))
+        with resync_shopping_lists(recipe_ids):
+            super().delete_queryset(request, queryset)
+        bump_amount_recipes(recipe_ids)
@@ -0,0 +1,141 @@
+from django.db import transaction
+
+from recipes.models import Favorite, Follow, Purchase, Recipe, User
+
+from .cache import change_purchases_count, invalidate_id_set
+from .feed import change_followers_counts, follow_authors, unfollow_authors
+from .util import (change_recipe_counters, change_shopping_lists,
+                   get_shopping_changes)
+
+# The manager, the id field and the cached id set of every relation
+BATCH_RELATIONS = {
+    'favorites': (Favorite.favorite, 'recipe_id', 'favorites'),
+    'purchases': (Purchase.objects, 'recipe_id', 'purchases'),
+    'subscriptions': (Follow.objects, 'author_id', 'following'),
+}
+BATCH_ACTIONS = ('add', 'remove')
+
+
+def _error(message):
+    return {'success': False, 'error': message}
+
+
+def _parse(operation):
+    try:
+        relation, action = operation['relation'], operation['action']
+        pk = int(operation['id'])
+    except (TypeError, KeyError, ValueError):
+        return None
+    if relation not in BATCH_RELATIONS or action not in BATCH_ACTIONS:
+        return None
+    return relation, action, pk
+
+
+def _get_known_ids(user, operations):
+    """
+    Existing targets of the operations, one IN query per model
+    """
+    ids = {relation: set() for relation in BATCH_RELATIONS}
+    for _, (relation, _, pk) in operations:
+        ids[relation].add(pk)
+    recipe_ids = ids['favorites'] | ids['purchases']
+    recipes = set(Recipe.recipes.filter(pk__in=recipe_ids).values_list(
+        'pk', flat=True)) if recipe_ids else set()
+    authors = set(User.objects.filter(pk__in=ids['subscriptions']).exclude(
+        pk=user.pk).values_list('pk', flat=True)
+    ) if ids['subscriptions'] else set()
+    return {'favorites': recipes, 'purchases': recipes,
+            'subscriptions': authors}
+
+
+def _insert(manager, user, field, ids):
+    """
+    Creates the missing rows and returns the ids inserted by this
+    transaction: bulk_create skips the rows a concurrent request has added
+    since the relation was read, they must not be counted twice
+    """
+    rows = manager.filter(user=user, **{f'{field}__in': ids})
+    existing = set(rows.select_for_update().values_list(field, flat=True))
+    manager.bulk_create(
+        [manager.model(user=user, **{field: pk}) for pk in ids - existing],
+        ignore_conflicts=True
+    )
+    return set(rows.values_list(field, flat=True)) - existing
+
+
+def _apply_changes(user, relation, added, removed):
+    manager, field, _ = BATCH_RELATIONS[relation]
+    if added:
+        added = _insert(manager, user, field, added)
+    if removed:
+        manager.filter(user=user, **{f'{field}__in': removed}).delete()
+
+    if relation == 'subscriptions':
+        change_followers_counts(added, 1)
+        change_followers_counts(removed, -1)
+        follow_authors(user.id, added)
+        unfollow_authors(user.id, removed)
+        return
+    counter = f'{relation}_count'
+    change_recipe_counters(added, counter, 1)
+    change_recipe_counters(removed, counter, -1)
+    if relation == 'purchases':
+        signs = {**dict.fromkeys(added, 1), **dict.fromkeys(removed, -1)}
+        change_shopping_lists([user.id], get_shopping_changes(signs))
+        # Deleted purchases update the counter through post_delete
+        count = len(added)
+        transaction.on_commit(lambda: change_purchases_count(user.id, count))
+
+
+def apply_batch(user, operations):
+    """
+    Applies a list of {'relation', 'action', 'id'} operations to the user's
+    favorites, purchases and subscriptions in one transaction.
+    The operations are applied in order: an add succeeds if the object
+    was not in the relation yet, a remove if it was. Returns a result
+    per operation, the unknown or invalid ones get an error message.
+    """
+    results, parsed = [], []
+    for index, operation in enumerate(operations):
+        operation = _parse(operation)
+        results.append(_error('Неверная операция'))
+        if operation is not None:
+            parsed.append((index, operation))
+    known = _get_known_ids(user, parsed)
+
+    with transaction.atomic():
+        initial = {}
+        for relation, (manager, field, _) in BATCH_RELATIONS.items():
+            initial[relation] = set(manager.select_for_update().filter(
+                user=user, **{f'{field}__in': known[relation]}
+            ).values_list(field, flat=True)) if known[relation] else set()
+        current = {relation: set(ids) for relation, ids in initial.items()}
+
+        for index, (relation, action, pk) in parsed:
+            if relation == 'subscriptions' and pk == user.pk:
+                results[index] = _error(
+                    'Пользователь не может подписываться сам на себя')
+                continue
+            if pk not in known[relation]:
+                results[index] = _error('Объект не найден')
+                continue
+            state = current[relation]
+            if action == 'add':
+                results[index] = {'success': pk not in state}
+                state.add(pk)
+            else:
+                results[index] = {'success': pk in state}
+                state.discard(pk)
+
+        changes = {
+            relation: (current[relation] - ids, ids - current[relation])
+            for relation, ids in initial.items()
+        }
+        for relation, (added, removed) in changes.items():
+            if added or removed:
+                _apply_changes(user, relation, added, removed)
+
+    for relation, (added, removed) in changes.items():
+        if added or removed:
+            invalidate_id_set(user.id, BATCH_RELATIONS[relation][2])
+    return results
@@ -0,0 +1,249 @@
+import hashlib
+import time
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from recipes.models import Favorite, Follow, Purchase, Tag
+
+PAGE_CACHE_PREFIX = 'page_cache'
+PAGE_CACHE_PARAMS = {'filters', 'cursor'}
+# The cached pages are (content, headers), older entries are ignored
+PAGE_CACHE_VERSION = 2
+PURCHASES_COUNT_KEY = 'purchases_count:{}'
+CATALOG_VERSION_KEY = 'ingredients:version'
+ID_SET_KEY = 'id_set:{}:{}'
+# The model manager and the id field of every cached id set
+ID_SETS = {
+    'favorites': (Favorite.favorite, 'recipe_id'),
+    'purchases': (Purchase.objects, 'recipe_id'),
+    'following': (Follow.objects, 'author_id'),
+}
+
+
+def _generation_key(name):
+    return f'{PAGE_CACHE_PREFIX}:gen:{name}'
+
+
+def get_generations(names):
+    """
+    Returns the current generation of every name.
+    A missing generation starts from the current time so that it never
+    matches the pages cached before the key was evicted.
+    """
+    keys = [_generation_key(name) for name in names]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, time.time_ns(), None)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+def invalidate_pages(*names):
+    """
+    Bumps the generations, which makes every page cached under them stale
+    """
+    for name in names:
+        key = _generation_key(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def _count(event):
+    key = f'{PAGE_CACHE_PREFIX}:stats:{event}'
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def get_page_cache_stats():
+    """
+    Returns the hit and miss counters of the page cache
+    """
+    keys = {event: f'{PAGE_CACHE_PREFIX}:stats:{event}'
+            for event in ('hits', 'misses')}
+    values = cache.get_many(keys.values())
+    return {event: values.get(key, 0) for event, key in keys.items()}
+
+
+def reset_page_cache_stats():
+    cache.delete_many([f'{PAGE_CACHE_PREFIX}:stats:{event}'
+                       for event in ('hits', 'misses')])
+
+
+def get_purchases_count(user_id):
+    """
+    Returns the size of the user's shopping list,
+    the database is queried only when the cache is cold.
+    The fill never overwrites a counter written meanwhile, a change
+    committed between the count and the fill is lost until it expires.
+    """
+    key = PURCHASES_COUNT_KEY.format(user_id)
+    count = cache.get(key)
+    if count is None:
+        count = Purchase.objects.filter(user=user_id).count()
+        cache.add(key, count, settings.PURCHASES_COUNT_TIMEOUT)
+    return count
+
+
+def change_purchases_count(user_id, delta):
+    """
+    Write-through update of the cached shopping list size.
+    A cold counter is left to be computed on the next read.
+    """
+    try:
+        cache.incr(PURCHASES_COUNT_KEY.format(user_id), delta)
+    except ValueError:
+        pass
+
+
+class IdSet:
+    """
+    Sorted array of ids, cached as raw bytes and searched by bisection
+    """
+
+    __slots__ = ('ids',)
+
+    def __init__(self, ids=()):
+        self.ids = array('q', sorted(set(ids)))
+
+    @classmethod
+    def from_bytes(cls, raw):
+        id_set = cls()
+        id_set.ids.frombytes(raw)
+        return id_set
+
+    def to_bytes(self):
+        return self.ids.tobytes()
+
+    def __contains__(self, pk):
+        index = bisect_left(self.ids, pk)
+        return index < len(self.ids) and self.ids[index] == pk
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def get_id_set(user_id, kind):
+    """
+    Returns the ids of the user's favorites, purchases or followed authors,
+    the database is queried only when the cache is cold
+    """
+    key = ID_SET_KEY.format(kind, user_id)
+    raw = cache.get(key)
+    if raw is not None:
+        return IdSet.from_bytes(raw)
+    manager, field = ID_SETS[kind]
+    id_set = IdSet(manager.filter(user=user_id).values_list(field, flat=True))
+    cache.set(key, id_set.to_bytes(), settings.ID_SET_TIMEOUT)
+    return id_set
+
+
+def invalidate_id_set(user_id, kind):
+    """
+    Drops a cached id set after the change is committed, the next read
+    loads it again. The changes made elsewhere show up once the set expires.
+    """
+    cache.delete(ID_SET_KEY.format(kind, user_id))
+
+
+def get_catalog_version():
+    """
+    Returns the version of the ingredient catalog shared by all processes
+    """
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, time.time_ns(), None)
+
+
+def get_tag_slugs():
+    """
+    Returns the slugs of all tags, cached until a tag changes
+    """
+    key = f'{PAGE_CACHE_PREFIX}:tag_slugs:{get_generations(["tags"])[0]}'
+    slugs = cache.get(key)
+    if slugs is None:
+        slugs = set(Tag.objects.values_list('slug', flat=True))
+        cache.set(key, slugs, settings.PAGE_CACHE_TIMEOUT)
+    return slugs
+
+
+class AnonymousPageCacheMixin:
+    """
+    Caches the rendered page for anonymous users.
+    The key consists of the normalized filters, the page cursor and
+    the generations returned by get_page_cache_generations(), which are
+    bumped by the signal handlers when the data on the page changes.
+    """
+
+    page_cache_name = None
+
+    def get_page_cache_generations(self):
+        return []
+
+    def get_page_cache_key(self):
+        request = self.request
+        if (self.page_cache_name is None
+                or request.method != 'GET'
+                or request.user.is_authenticated
+                or not set(request.GET) <= PAGE_CACHE_PARAMS):
+            return None
+        filters = set(request.GET.getlist('filters'))
+        if filters:
+            # Unknown slugs select nothing, they must not add cache entries
+            filters &= get_tag_slugs()
+        cursor = request.GET.get('cursor', '')
+        names = self.get_page_cache_generations()
+        generations = '.'.join(
+            f'{name}={generation}' for name, generation in
+            zip(names, get_generations(names))
+        )
+        # Hashed like make_template_fragment_key, the cursor is unbounded
+        digest = hashlib.md5(
+            f'{generations}:{",".join(sorted(filters))}:{cursor}'.encode()
+        )
+        return (f'{PAGE_CACHE_PREFIX}:{self.page_cache_name}:'
+                f'{digest.hexdigest()}')
+
+    def dispatch(self, request, *args, **kwargs):
+        key = self.get_page_cache_key()
+        if key is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        cached = cache.get(key, version=PAGE_CACHE_VERSION)
+        if cached is not None:
+            _count('hits')
+            content, headers = cached
+            response = HttpResponse(content)
+            for header, value in headers:
+                response[header] = value
+            return response
+
+        _count('misses')
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200:
+            response.render()
+            cache.set(key, (response.content, list(response.items())),
+                      settings.PAGE_CACHE_TIMEOUT,
+                      version=PAGE_CACHE_VERSION)
+        return response
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import logging
+from concurrent.futures import TimeoutError
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from PIL import Image, ImageDraw, ImageFont
+
+from recipes.models import Purchase
+
+from .cache import get_catalog_version
+from .units import format_quantity
+from .util import SHOPPING_LIST_RECIPES, get_shopping_list
+from .workers import get_executor
+
+SHOPPING_LIST_SECTIONS = ('Блюда:', 'Ингредиенты:')
+EXPORT_FORMATS = {
+    'txt': 'text/plain; charset=utf-8',
+    'json': 'application/json',
+    'pdf': 'application/pdf',
+}
+EXPORT_KEY = 'shopping_list:{}:{}:{}'
+
+# A4 page at 150 dpi
+PDF_PAGE_SIZE = (1240, 1754)
+PDF_MARGIN = 100
+PDF_LINE_HEIGHT = 40
+
+
+def get_export_key(user, export_format):
+    """
+    Cache key of the rendered shopping list: a hash of the purchased
+    recipes and their versions, which changes with any edit of the list.
+    Only the purchases and the recipes are read.
+    """
+    digest = hashlib.sha256(
+        f'{user.get_full_name()}:{get_catalog_version()}'.encode()
+    )
+    purchases = Purchase.objects.filter(user=user).order_by(
+        'recipe_id').values_list('recipe_id', 'recipe__card_version')
+    for recipe_id, version in purchases:
+        digest.update(f':{recipe_id}.{version}'.encode())
+    return EXPORT_KEY.format(user.pk, export_format, digest.hexdigest())
+
+
+def _iter_rows(user):
+    return get_shopping_list(user).iterator(
+        chunk_size=settings.SHOPPING_LIST_CHUNK_SIZE
+    )
+
+
+def iter_shopping_list(user):
+    yield f'Список покупок: {user.get_full_name()}\n'
+    section = -1
+    for row_section, title, *quantity in _iter_rows(user):
+        while section < row_section:
+            section += 1
+            yield f'\n{SHOPPING_LIST_SECTIONS[section]}\n'
+        if row_section == SHOPPING_LIST_RECIPES:
+            yield f'{title}\n'
+        else:
+            yield f'{title} - {format_quantity(*quantity)}\n'
+    while section < len(SHOPPING_LIST_SECTIONS) - 1:
+        section += 1
+        yield f'\n{SHOPPING_LIST_SECTIONS[section]}\n'
+
+
+def iter_cached(key, parts):
+    """
+    Passes the parts of a streamed document through
+    and caches the whole document once it is complete
+    """
+    collected = []
+    for part in parts:
+        collected.append(part)
+        yield part
+    cache.set(key, ''.join(collected).encode(),
+              settings.SHOPPING_LIST_CACHE_TIMEOUT)
+
+
+def render_json(user):
+    recipes, ingredients = [], []
+    for section, title, *quantity in _iter_rows(user):
+        if section == SHOPPING_LIST_RECIPES:
+            recipes.append(title)
+        else:
+            ingredients.append(
+                {'name': title, 'quantity': format_quantity(*quantity)}
+            )
+    return json.dumps(
+        {'user': user.get_full_name(), 'recipes': recipes,
+         'ingredients': ingredients},
+        ensure_ascii=False
+    ).encode()
+
+
+def render_pdf(lines):
+    """
+    Draws the lines on A4 pages with Pillow and saves them as a PDF
+    """
+    try:
+        font = ImageFont.truetype(settings.PDF_FONT, 28)
+    except OSError:
+        # The default bitmap font has no Cyrillic glyphs
+        raise ImproperlyConfigured(
+            f'PDF_FONT {settings.PDF_FONT!r} is not a readable TrueType font'
+        )
+    per_page = (PDF_PAGE_SIZE[1] - 2 * PDF_MARGIN) // PDF_LINE_HEIGHT
+    pages = []
+    for start in range(0, max(len(lines), 1), per_page):
+        page = Image.new('L', PDF_PAGE_SIZE, 255)
+        draw = ImageDraw.Draw(page)
+        for number, line in enumerate(lines[start:start + per_page]):
+            position = (PDF_MARGIN, PDF_MARGIN + number * PDF_LINE_HEIGHT)
+            draw.text(position, line, font=font, fill=0)
+        pages.append(page)
+    buffer = BytesIO()
+    pages[0].save(buffer, 'PDF', resolution=150, save_all=True,
+                  append_images=pages[1:])
+    return buffer.getvalue()
+
+
+def _render_pdf_in_background(key, lines):
+    try:
+        content = render_pdf(lines)
+        cache.set(key, content, settings.SHOPPING_LIST_CACHE_TIMEOUT)
+        return content
+    except Exception:
+        logging.exception("Failed to render the shopping list '%s'", key)
+        raise
+    finally:
+        cache.delete(f'{key}:pending')
+
+
+def get_pdf(user, key):
+    """
+    Renders the PDF on the export pool and waits PDF_RENDER_WAIT seconds
+    for it. Returns None if the document is not ready by then, it is
+    cached once rendered and served by the next download.
+    The pending flag is kept in the cache: with the per-process
+    LocMemCache every process renders its own copy of the document.
+    """
+    if not cache.add(f'{key}:pending', True, settings.PDF_RENDER_TIMEOUT):
+        return None
+    try:
+        lines = ''.join(iter_shopping_list(user)).splitlines()
+    except Exception:
+        cache.delete(f'{key}:pending')
+        raise
+    future = get_executor('exports', settings.EXPORT_WORKERS).submit(
+        _render_pdf_in_background, key, lines
+    )
+    try:
+        return future.result(timeout=settings.PDF_RENDER_WAIT)
+    except TimeoutError:
+        return None
@@ -0,0 +1,184 @@
+import logging
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+
+from recipes.models import AuthorCounter, FeedEntry, Follow, Recipe
+
+from .util import get_latest_recipes
+from .workers import get_executor
+
+
+def is_pulled(author_id):
+    """
+    The recipes of the authors with more than FEED_PUSH_LIMIT followers
+    are not copied to the feeds, the feed queries them when it is read
+    """
+    return bool(get_pulled_authors([author_id]))
+
+
+def get_pulled_authors(author_ids):
+    return set(AuthorCounter.objects.filter(
+        author_id__in=author_ids,
+        followers_count__gt=settings.FEED_PUSH_LIMIT
+    ).values_list('author_id', flat=True))
+
+
+def change_followers_count(author_id, delta):
+    """
+    Atomically shifts the followers counter of the author
+    """
+    change_followers_counts([author_id], delta)
+
+
+def change_followers_counts(author_ids, delta):
+    """
+    The counters never drop below zero. The authors who drop to
+    FEED_PUSH_LIMIT followers are no longer pulled by the feed,
+    their latest recipes are copied to the feeds after the commit.
+    """
+    author_ids = list(author_ids)
+    if not author_ids:
+        return
+    with transaction.atomic():
+        AuthorCounter.objects.bulk_create(
+            [AuthorCounter(author_id=author_id) for author_id in author_ids],
+            ignore_conflicts=True
+        )
+        counters = AuthorCounter.objects.select_for_update().filter(
+            author_id__in=author_ids
+        )
+        demoted = [
+            author_id for author_id, count in
+            counters.values_list('author_id', 'followers_count')
+            if count > settings.FEED_PUSH_LIMIT >= count + delta
+        ]
+        counters.update(
+            followers_count=Greatest(F('followers_count') + delta, 0)
+        )
+        if demoted:
+            schedule_backfill(demoted)
+
+
+def _write_entries(entries):
+    FeedEntry.objects.bulk_create(
+        entries, batch_size=settings.FEED_BATCH_SIZE, ignore_conflicts=True
+    )
+
+
+def fan_out(recipe_id):
+    """
+    Adds the recipe to the feeds of its author's followers
+    in batches of FEED_BATCH_SIZE, returns the number of the feeds
+    """
+    author_id = Recipe.recipes.filter(pk=recipe_id).values_list(
+        'author_id', flat=True).first()
+    if author_id is None or is_pulled(author_id):
+        return 0
+    followers = Follow.objects.filter(author_id=author_id).values_list(
+        'user_id', flat=True)
+    entries, written = [], 0
+    for user_id in followers.iterator(chunk_size=settings.FEED_BATCH_SIZE):
+        entries.append(FeedEntry(user_id=user_id, recipe_id=recipe_id))
+        if len(entries) == settings.FEED_BATCH_SIZE:
+            _write_entries(entries)
+            written, entries = written + len(entries), []
+    _write_entries(entries)
+    return written + len(entries)
+
+
+def _fan_out_in_background(recipe_id):
+    try:
+        fan_out(recipe_id)
+    except Exception:
+        logging.exception('Failed to fan out the recipe %s', recipe_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_fan_out(recipe_id):
+    transaction.on_commit(
+        lambda: get_executor(
+            'feed', settings.FEED_WORKERS
+        ).submit(_fan_out_in_background, recipe_id)
+    )
+
+
+def backfill_followers(author_ids):
+    """
+    Copies the latest FEED_BACKFILL recipes of the authors in the push mode
+    to the feeds of their followers, FEED_BATCH_SIZE entries at a time
+    """
+    author_ids = set(author_ids) - get_pulled_authors(author_ids)
+    latest = get_latest_recipes(author_ids, settings.FEED_BACKFILL)
+    for author_id, (recipes, _) in latest.items():
+        followers = Follow.objects.filter(author_id=author_id).values_list(
+            'user_id', flat=True)
+        entries = []
+        for user_id in followers.iterator(
+                chunk_size=settings.FEED_BATCH_SIZE):
+            entries += [FeedEntry(user_id=user_id, recipe_id=recipe.pk)
+                        for recipe in recipes]
+            if len(entries) >= settings.FEED_BATCH_SIZE:
+                _write_entries(entries)
+                entries = []
+        _write_entries(entries)
+
+
+def _backfill_in_background(author_ids):
+    try:
+        backfill_followers(author_ids)
+    except Exception:
+        logging.exception('Failed to backfill the feeds of %s', author_ids)
+    finally:
+        close_old_connections()
+
+
+def schedule_backfill(author_ids):
+    transaction.on_commit(
+        lambda: get_executor(
+            'feed', settings.FEED_WORKERS
+        ).submit(_backfill_in_background, author_ids)
+    )
+
+
+def follow_author(user_id, author_id):
+    follow_authors(user_id, [author_id])
+
+
+def follow_authors(user_id, author_ids):
+    """
+    Copies the latest FEED_BACKFILL recipes of the followed authors
+    to the feed
+    """
+    author_ids = set(author_ids) - get_pulled_authors(author_ids)
+    latest = get_latest_recipes(author_ids, settings.FEED_BACKFILL)
+    _write_entries([
+        FeedEntry(user_id=user_id, recipe_id=recipe.pk)
+        for recipes, _ in latest.values() for recipe in recipes
+    ])
+
+
+def unfollow_author(user_id, author_id):
+    unfollow_authors(user_id, [author_id])
+
+
+def unfollow_authors(user_id, author_ids):
+    FeedEntry.objects.filter(
+        user_id=user_id, recipe__author_id__in=author_ids
+    ).delete()
+
+
+def get_feed_queryset(user):
+    """
+    Recipes of the followed authors: the entries of the user's feed
+    and the recipes of the followed authors in the pull mode
+    """
+    pushed = FeedEntry.objects.filter(user=user).values('recipe_id')
+    pulled = Follow.objects.filter(
+        user=user,
+        author__counter__followers_count__gt=settings.FEED_PUSH_LIMIT
+    ).values('author_id')
+    return Recipe.recipes.filter(Q(pk__in=pushed) | Q(author__in=pulled))
@@ -1,14 +1,43 @@
 from django import forms
 from django.forms.widgets import CheckboxSelectMultiple
+from PIL import Image
 
 from recipes.models import Recipe, Tag
 
+from .validators import check_image_header
+
+
+class ImageHeaderField(forms.ImageField):
+    """
+    Image field checking the upload by its header,
+    unlike forms.ImageField it does not verify the whole file
+    """
+
+    def to_python(self, data):
+        f = forms.FileField.to_python(self, data)
+        if f is None:
+            return None
+        image_format = check_image_header(f)
+        f.content_type = Image.MIME.get(image_format)
+        return f
+
 
 class RecipeForm(forms.ModelForm):
     """
     Recipe Form
     """
-    image = forms.ImageField(required=False)
+    image = ImageHeaderField(required=False)
+
+    def __init__(self, *args, upload_errors=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.upload_errors = upload_errors or {}
+
+    def clean(self):
+        cleaned_data = super().clean()
+        for field, error in self.upload_errors.items():
+            if field in self.fields:
+                self.add_error(field, error)
+        return cleaned_data
 
     class Meta:
         model = Recipe
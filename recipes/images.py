@@ -0,0 +1,168 @@
+import logging
+import os
+from collections import namedtuple
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from PIL import Image, ImageOps
+
+from recipes.models import Recipe
+
+from .cache import invalidate_pages
+from .workers import get_executor
+
+ImageVariant = namedtuple('ImageVariant', 'width height sizes')
+
+# Every size the templates show a recipe image at
+IMAGE_VARIANTS = {
+    'card': ImageVariant(360, 240, '(max-width: 363px) 100vw, 363px'),
+    'detail': ImageVariant(480, 480, '480px'),
+    'small': ImageVariant(90, 90, '90px'),
+}
+# The width ladder of a variant, relative to its displayed size
+DENSITIES = (1, 1.5, 2)
+VARIANTS_DIR = 'variants'
+
+# Formats the fallback is kept in, anything else falls back to JPEG
+FALLBACK_FORMATS = {'JPEG': '.jpg', 'PNG': '.png'}
+
+
+def variant_name(name, variant, width, extension):
+    """
+    Storage name of a pre-built variant of the image
+    """
+    root, _ = os.path.splitext(name)
+    return f'{VARIANTS_DIR}/{root}_{variant}_{width}{extension}'
+
+
+def variant_widths(variant, source_width, source_height):
+    """
+    The widths of the ladder, the images are never upscaled
+    beyond the displayed size
+    """
+    widths = []
+    for density in DENSITIES:
+        width = round(variant.width * density)
+        height = round(variant.height * density)
+        if density == 1 or (width <= source_width
+                            and height <= source_height):
+            widths.append((width, height))
+    return widths
+
+
+def _encode(image, image_format):
+    buffer = BytesIO()
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    elif image_format == 'WEBP' and image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    if image_format == 'PNG':
+        image.save(buffer, image_format, optimize=True)
+    else:
+        image.save(buffer, image_format, quality=80)
+    return ContentFile(buffer.getvalue())
+
+
+def generate_variants(name, force=False):
+    """
+    Generates the missing files of the width ladder of every variant
+    in WebP and in the fallback format.
+    Returns the manifest of the variants
+    {'source': name, 'variants': {variant: [[width, webp, fallback]]}}
+    and the names of the generated files.
+    """
+    manifest, generated = {'source': name, 'variants': {}}, []
+    with default_storage.open(name) as file, Image.open(file) as source:
+        fallback_format = (source.format if source.format in FALLBACK_FORMATS
+                           else 'JPEG')
+        formats = (('WEBP', '.webp'),
+                   (fallback_format, FALLBACK_FORMATS[fallback_format]))
+        image = None
+        for variant_key, variant in IMAGE_VARIANTS.items():
+            ladder = []
+            for width, height in variant_widths(variant, *source.size):
+                names = []
+                for image_format, extension in formats:
+                    target = variant_name(name, variant_key, width, extension)
+                    names.append(target)
+                    if not force and default_storage.exists(target):
+                        continue
+                    if image is None:
+                        image = ImageOps.exif_transpose(source)
+                    content = _encode(
+                        ImageOps.fit(image, (width, height), Image.LANCZOS),
+                        image_format
+                    )
+                    default_storage.delete(target)
+                    generated.append(default_storage.save(target, content))
+                ladder.append([width, *names])
+            manifest['variants'][variant_key] = ladder
+    return manifest, generated
+
+
+def get_image_sources(recipe, variant):
+    """
+    Returns the context of the responsive image: the WebP and fallback
+    srcset of the variant and the sizes attribute.
+    The original is served alone until the variants are generated.
+    """
+    image = recipe.image
+    if not image:
+        return {}
+    manifest = recipe.image_variants or {}
+    ladder = manifest.get('variants', {}).get(variant)
+    if manifest.get('source') != image.name or not ladder:
+        return {'src': image.url}
+    webp = [(default_storage.url(webp_name), width)
+            for width, webp_name, _ in ladder]
+    fallback = [(default_storage.url(fallback_name), width)
+                for width, _, fallback_name in ladder]
+    return {
+        'src': fallback[0][0],
+        'webp_srcset': ', '.join(f'{url} {width}w' for url, width in webp),
+        'srcset': ', '.join(f'{url} {width}w' for url, width in fallback),
+        'sizes': IMAGE_VARIANTS[variant].sizes,
+    }
+
+
+def store_image_variants(name, manifest):
+    """
+    Saves the manifest to the recipes using the image and invalidates
+    their cached cards and pages, so they switch to the variants
+    """
+    recipes = [
+        (pk, author_id) for pk, author_id, variants in
+        Recipe.recipes.filter(image=name).values_list(
+            'pk', 'author_id', 'image_variants')
+        if variants != manifest
+    ]
+    if not recipes:
+        return
+    Recipe.recipes.filter(pk__in=[pk for pk, _ in recipes]).update(
+        image_variants=manifest, card_version=F('card_version') + 1
+    )
+    invalidate_pages(
+        'recipes', *{f'author:{author_id}' for _, author_id in recipes}
+    )
+
+
+def _generate_in_background(name):
+    try:
+        manifest, _ = generate_variants(name)
+        store_image_variants(name, manifest)
+    except Exception:
+        logging.exception("Failed to generate the variants of '%s'", name)
+    finally:
+        close_old_connections()
+
+
+def schedule_image_variants(name):
+    transaction.on_commit(
+        lambda: get_executor(
+            'image-variants', settings.IMAGE_WORKERS
+        ).submit(_generate_in_background, name)
+    )
@@ -0,0 +1,25 @@
+from itertools import groupby
+from operator import itemgetter
+
+from django.core.management.base import BaseCommand, no_translations
+
+from recipes.feed import follow_authors
+from recipes.models import Follow
+
+
+class Command(BaseCommand):
+    help = 'Fill the feeds with the latest recipes of the followed authors'
+
+    @no_translations
+    def handle(self, *args, **options):
+        """
+        python manage.py backfill_feed
+        Also repairs the feeds of the authors who dropped
+        below FEED_PUSH_LIMIT followers.
+        """
+        follows = Follow.objects.order_by('user_id').values_list(
+            'user_id', 'author_id')
+        for user_id, authors in groupby(follows.iterator(),
+                                        key=itemgetter(0)):
+            follow_authors(user_id, [author_id for _, author_id in authors])
+        self.stdout.write(f'Filled the feeds of {follows.count()} follows')
@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, no_translations
+
+from recipes.images import generate_variants, store_image_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Generate the missing variants of the stored recipe images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int,
+                            default=settings.IMAGE_WORKERS)
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate the existing variants too')
+
+    @no_translations
+    def handle(self, *args, **options):
+        """
+        python manage.py backfill_image_variants
+        """
+        names = list(
+            Recipe.recipes.exclude(
+                image__in=['', Recipe._meta.get_field('image').default]
+            ).order_by()
+            .values_list('image', flat=True).distinct()
+        )
+        force, images, failed, generated = options['force'], 0, 0, 0
+
+        def generate(name):
+            return name, generate_variants(name, force=force)
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = [executor.submit(generate, name) for name in names]
+            for future in futures:
+                try:
+                    name, (manifest, files) = future.result()
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(str(error))
+                    continue
+                store_image_variants(name, manifest)
+                images += 1
+                generated += len(files)
+
+        self.stdout.write(f'Generated {generated} files for {images} images, '
+                          f'{failed} failed')
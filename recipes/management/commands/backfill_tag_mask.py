@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, no_translations
+
+from recipes.models import Recipe
+from recipes.util import update_tag_masks
+
+
+class Command(BaseCommand):
+    help = 'Populate the tag bitmask of existing recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    @no_translations
+    def handle(self, *args, **options):
+        """
+        The function recomputes Recipe.tag_mask from the tag relation
+        python manage.py backfill_tag_mask
+        """
+        batch_size = options['batch_size']
+        recipe_ids = list(
+            Recipe.recipes.order_by('pk').values_list('pk', flat=True)
+        )
+        for start in range(0, len(recipe_ids), batch_size):
+            update_tag_masks(recipe_ids[start:start + batch_size])
+        self.stdout.write(f'Updated {len(recipe_ids)} recipes')
@@ -0,0 +1,92 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, no_translations
+
+from recipes.models import Ingredient
+from recipes.search import IngredientPrefixIndex, IngredientTrigramIndex
+
+ALPHABET = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя'
+
+
+def misspell(name, rng):
+    """
+    Applies one random typo: a substitution, a deletion or a transposition
+    """
+    if len(name) < 3:
+        return name
+    position = rng.randrange(1, len(name) - 1)
+    typo = rng.choice(('substitute', 'delete', 'transpose'))
+    if typo == 'substitute':
+        return name[:position] + rng.choice(ALPHABET) + name[position + 1:]
+    if typo == 'delete':
+        return name[:position] + name[position + 1:]
+    return (name[:position - 1] + name[position] + name[position - 1]
+            + name[position + 1:])
+
+
+def synthetic_catalog(rows, size, rng):
+    """
+    Builds a catalog of the given size from random combinations
+    of the words of the real ingredient names
+    """
+    words = sorted({word for name, _ in rows for word in name.split()})
+    units = sorted({unit for _, unit in rows})
+    return [
+        (' '.join(rng.sample(words, rng.randint(1, 3))), rng.choice(units))
+        for _ in range(size)
+    ]
+
+
+def percentile(samples, rank):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * rank))]
+
+
+class Command(BaseCommand):
+    help = 'Measure the latency of the ingredient prefix and trigram search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=2000)
+        parser.add_argument('--synthetic-size', type=int, default=100000)
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=42)
+
+    @no_translations
+    def handle(self, *args, **options):
+        """
+        python manage.py benchmark_ingredient_search
+        """
+        rng = random.Random(options['seed'])
+        rows = list(Ingredient.objects.values_list('name', 'unit'))
+        if not rows:
+            self.stderr.write('The ingredient catalog is empty, '
+                              'run load_product_data first')
+            return
+        catalogs = [
+            ('catalog', rows),
+            ('synthetic',
+             synthetic_catalog(rows, options['synthetic_size'], rng)),
+        ]
+        for title, catalog in catalogs:
+            queries = [misspell(name.casefold(), rng) for name, _ in
+                       rng.choices(catalog, k=options['queries'])]
+            for index in (IngredientPrefixIndex(), IngredientTrigramIndex()):
+                self._run(title, catalog, queries, index, options['limit'])
+
+    def _run(self, title, catalog, queries, index, limit):
+        start = time.perf_counter()
+        data = index.build(catalog)
+        build_time = time.perf_counter() - start
+
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            index.lookup(data, query, limit)
+            timings.append((time.perf_counter() - start) * 1000)
+        self.stdout.write(
+            f'{title} ({len(catalog)} entries), '
+            f'{type(index).__name__}: build {build_time:.2f} s, '
+            f'p50 {percentile(timings, 0.5):.3f} ms, '
+            f'p99 {percentile(timings, 0.99):.3f} ms'
+        )
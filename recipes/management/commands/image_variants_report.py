@@ -0,0 +1,60 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, no_translations
+
+from recipes.images import IMAGE_VARIANTS
+from recipes.models import Recipe
+
+
+def _size(name):
+    try:
+        return default_storage.size(name)
+    except OSError:
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Report the bytes saved by serving the image variants'
+
+    @no_translations
+    def handle(self, *args, **options):
+        """
+        python manage.py image_variants_report
+        Compares the original of every image with the 1x files of its
+        variants, which is what a standard density screen downloads.
+        """
+        manifests = dict(
+            Recipe.recipes.exclude(image='').order_by()
+            .values_list('image', 'image_variants')
+        )
+        totals = {variant: [0, 0, 0] for variant in IMAGE_VARIANTS}
+        pending, stored = 0, 0
+        for name, manifest in manifests.items():
+            original = _size(name)
+            if original is None:
+                continue
+            if (manifest or {}).get('source') != name:
+                pending += 1
+                continue
+            for variant, ladder in manifest['variants'].items():
+                if variant not in totals:
+                    continue
+                _, webp, fallback = ladder[0]
+                webp_size, fallback_size = _size(webp), _size(fallback)
+                if webp_size is None or fallback_size is None:
+                    continue
+                totals[variant][0] += original
+                totals[variant][1] += fallback_size
+                totals[variant][2] += webp_size
+                stored += sum(size for size in (
+                    _size(file) for _, *files in ladder for file in files
+                ) if size is not None)
+
+        for variant, (original, fallback, webp) in totals.items():
+            saved = original - webp
+            ratio = saved / original if original else 0
+            self.stdout.write(
+                f'{variant}: original {original} B, fallback {fallback} B, '
+                f'webp {webp} B, saved {saved} B ({ratio:.1%})'
+            )
+        self.stdout.write(f'variants on disk: {stored} B, '
+                          f'images without variants: {pending}')
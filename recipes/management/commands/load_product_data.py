@@ -1,8 +1,10 @@
 import csv
 
 from django.core.management.base import BaseCommand, no_translations
+from django.db import transaction
 
 from recipes.models import Ingredient, Tag
+from recipes.search import invalidate_catalog
 
 
 class Command(BaseCommand):
@@ -16,10 +18,17 @@ class Command(BaseCommand):
         """
 
         with open('recipes/fixtures/ingredients.csv') as isfile:
-            reader = csv.reader(isfile)
-            for row in reader:
-                name, unit = row
-                Ingredient.objects.get_or_create(name, unit=unit)
+            rows = dict.fromkeys(tuple(row) for row in csv.reader(isfile))
+
+        # bulk_create sends no signals, the catalog is invalidated once
+        with transaction.atomic():
+            existing = set(Ingredient.objects.values_list('name', 'unit'))
+            Ingredient.objects.bulk_create(
+                [Ingredient(name=name, unit=unit)
+                 for name, unit in rows if (name, unit) not in existing],
+                batch_size=500
+            )
+            transaction.on_commit(invalidate_catalog)
 
         Tag.objects.get_or_create(name='Завтрак',
                                   slug='breakfast',
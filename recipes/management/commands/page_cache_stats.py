@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, no_translations
+
+from recipes.cache import get_page_cache_stats, reset_page_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Show hit/miss statistics of the anonymous page cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true')
+
+    @no_translations
+    def handle(self, *args, **options):
+        """
+        python manage.py page_cache_stats [--reset]
+        The local-memory backend keeps the counters inside the web process,
+        so the command reports them for a shared (file) cache only.
+        """
+        stats = get_page_cache_stats()
+        total = stats['hits'] + stats['misses']
+        ratio = stats['hits'] / total if total else 0
+        self.stdout.write(
+            f'hits: {stats["hits"]}, misses: {stats["misses"]}, '
+            f'hit ratio: {ratio:.1%}'
+        )
+        if options['reset']:
+            reset_page_cache_stats()
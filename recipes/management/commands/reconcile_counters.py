@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, no_translations
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import (AuthorCounter, Favorite, Follow, Purchase, Recipe,
+                            User)
+
+
+def _count_subquery(queryset, field):
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+            field).annotate(total=Count('pk')).values('total'),
+        output_field=IntegerField()
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = 'Repair the drift of the favorite, purchase and follower counters'
+
+    @no_translations
+    def handle(self, *args, **options):
+        """
+        The function recomputes the denormalized counters and fixes
+        the rows that differ from the actual number of relations
+        python manage.py reconcile_counters
+        """
+        with transaction.atomic():
+            recipes = Recipe.recipes.annotate(
+                actual_favorites=_count_subquery(Favorite.favorite, 'recipe'),
+                actual_purchases=_count_subquery(Purchase.objects, 'recipe'),
+            ).only('favorites_count', 'purchases_count')
+            drifted = []
+            for recipe in recipes.iterator():
+                if (recipe.favorites_count != recipe.actual_favorites
+                        or recipe.purchases_count != recipe.actual_purchases):
+                    recipe.favorites_count = recipe.actual_favorites
+                    recipe.purchases_count = recipe.actual_purchases
+                    drifted.append(recipe)
+            Recipe.recipes.bulk_update(
+                drifted, ['favorites_count', 'purchases_count'],
+                batch_size=500
+            )
+
+            authors = User.objects.annotate(
+                actual_followers=_count_subquery(Follow.objects, 'author'),
+            ).values_list('pk', 'actual_followers')
+            counters = dict(AuthorCounter.objects.values_list(
+                'author_id', 'followers_count'))
+            fixed_authors = []
+            for author_id, followers in authors.iterator():
+                if counters.get(author_id, 0) != followers:
+                    fixed_authors.append(AuthorCounter(
+                        author_id=author_id, followers_count=followers))
+            AuthorCounter.objects.filter(
+                author_id__in=[counter.author_id for counter in fixed_authors]
+            ).delete()
+            AuthorCounter.objects.bulk_create(fixed_authors, batch_size=500)
+
+        self.stdout.write(
+            f'Fixed {len(drifted)} recipes and {len(fixed_authors)} authors'
+        )
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, no_translations
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from recipes.models import Amount, ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = 'Compare the shopping list rows with a full recompute'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help='Rebuild the lists that differ')
+
+    @no_translations
+    def handle(self, *args, **options):
+        """
+        The function aggregates the amounts of the purchased recipes
+        and reports the users whose ShoppingListItem rows differ
+        python manage.py verify_shopping_lists [--fix]
+        """
+        with transaction.atomic():
+            expected = {}
+            totals = Amount.objects.filter(
+                recipe__selected_recipes__isnull=False
+            ).order_by().values(
+                'recipe__selected_recipes__user', 'ingredient',
+                'ingredient__name', 'ingredient__unit'
+            ).annotate(
+                total=Sum('units'), recipes=Count('recipe', distinct=True)
+            )
+            for row in totals.iterator():
+                expected[(row['recipe__selected_recipes__user'],
+                          row['ingredient'])] = (
+                    row['ingredient__name'], row['ingredient__unit'],
+                    row['total'], row['recipes']
+                )
+            actual = {
+                (user_id, ingredient_id): tuple(rest)
+                for user_id, ingredient_id, *rest in
+                ShoppingListItem.objects.select_for_update().values_list(
+                    'user_id', 'ingredient_id', 'name', 'unit', 'total',
+                    'recipes_count'
+                ).iterator()
+            }
+            drifted = {
+                user_id for user_id, ingredient_id in {*expected, *actual}
+                if expected.get((user_id, ingredient_id))
+                != actual.get((user_id, ingredient_id))
+            }
+
+            if drifted and options['fix']:
+                ShoppingListItem.objects.filter(user_id__in=drifted).delete()
+                items = []
+                for (user_id, ingredient_id), row in expected.items():
+                    if user_id in drifted:
+                        name, unit, total, recipes = row
+                        items.append(ShoppingListItem(
+                            user_id=user_id, ingredient_id=ingredient_id,
+                            name=name, unit=unit, total=total,
+                            recipes_count=recipes
+                        ))
+                ShoppingListItem.objects.bulk_create(items, batch_size=500)
+
+        self.stdout.write(
+            f'Checked {len(expected)} rows, {len(drifted)} lists differ'
+            + (', rebuilt' if drifted and options['fix'] else '')
+        )
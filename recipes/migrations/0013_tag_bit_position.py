@@ -0,0 +1,60 @@
+import django.core.validators
+from django.db import migrations, models
+
+TAG_BITS = 63
+
+
+def assign_bit_positions(apps, schema_editor):
+    """
+    Numbers the existing tags from 0 and rebuilds the recipe masks,
+    the former bits were derived from the tag ids
+    """
+    Tag = apps.get_model('recipes', 'Tag')
+    recipes = apps.get_model('recipes', 'Recipe')._default_manager
+    tags = list(Tag.objects.order_by('pk'))
+    if len(tags) > TAG_BITS:
+        raise RuntimeError(f'More than {TAG_BITS} tags do not fit the mask')
+    for position, tag in enumerate(tags):
+        tag.bit_position = position
+    Tag.objects.bulk_update(tags, ['bit_position'])
+
+    bits = {tag.pk: 1 << tag.bit_position for tag in tags}
+    masks = dict.fromkeys(recipes.values_list('pk', flat=True), 0)
+    links = recipes.model.tag.through.objects.values_list(
+        'recipe_id', 'tag_id')
+    for recipe_id, tag_id in links:
+        masks[recipe_id] |= bits[tag_id]
+    for recipe_id, mask in masks.items():
+        recipes.filter(pk=recipe_id).update(
+            tag_mask=mask, card_version=models.F('card_version') + 1
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_feedentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='bit_position',
+            field=models.PositiveSmallIntegerField(editable=False, null=True, verbose_name='Бит тега в маске рецепта'),
+        ),
+        migrations.RunPython(assign_bit_positions, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tag',
+            name='bit_position',
+            field=models.PositiveSmallIntegerField(editable=False, unique=True, validators=[django.core.validators.MaxValueValidator(62)], verbose_name='Бит тега в маске рецепта'),
+        ),
+        migrations.AddConstraint(
+            model_name='tag',
+            constraint=models.CheckConstraint(check=models.Q(bit_position__lt=63), name='tag_bit_position_range'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='tag_mask',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Битовая маска тегов'),
+        ),
+    ]
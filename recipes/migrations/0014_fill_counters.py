@@ -0,0 +1,51 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def _counts(manager, field):
+    return dict(manager.order_by().values_list(field).annotate(
+        total=Count('pk')))
+
+
+def fill_counters(apps, schema_editor):
+    """
+    Counts the favorites, purchases and followers that existed
+    before the counters were added
+    """
+    recipes = apps.get_model('recipes', 'Recipe')._default_manager
+    favorites = _counts(
+        apps.get_model('recipes', 'Favorite')._default_manager, 'recipe')
+    purchases = _counts(
+        apps.get_model('recipes', 'Purchase')._default_manager, 'recipe')
+    changed = []
+    for recipe in recipes.filter(pk__in={*favorites, *purchases}).only(
+            'pk', 'favorites_count', 'purchases_count'):
+        recipe.favorites_count = favorites.get(recipe.pk, 0)
+        recipe.purchases_count = purchases.get(recipe.pk, 0)
+        changed.append(recipe)
+    recipes.bulk_update(changed, ['favorites_count', 'purchases_count'],
+                        batch_size=500)
+
+    AuthorCounter = apps.get_model('recipes', 'AuthorCounter')
+    followers = _counts(
+        apps.get_model('recipes', 'Follow')._default_manager, 'author')
+    AuthorCounter.objects.bulk_create(
+        [AuthorCounter(author_id=author_id) for author_id in followers],
+        ignore_conflicts=True, batch_size=500
+    )
+    counters = list(AuthorCounter.objects.filter(author_id__in=followers))
+    for counter in counters:
+        counter.followers_count = followers[counter.author_id]
+    AuthorCounter.objects.bulk_update(counters, ['followers_count'],
+                                      batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_tag_bit_position'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations
+from django.db.models import Count, Sum
+
+
+def fill_shopping_lists(apps, schema_editor):
+    """
+    Builds the shopping list rows of the purchases
+    that existed before the lists were materialized
+    """
+    Amount = apps.get_model('recipes', 'Amount')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    totals = Amount._default_manager.filter(
+        recipe__selected_recipes__isnull=False
+    ).order_by().values(
+        'recipe__selected_recipes__user', 'ingredient',
+        'ingredient__name', 'ingredient__unit'
+    ).annotate(
+        total=Sum('units'), recipes=Count('recipe', distinct=True)
+    )
+    ShoppingListItem.objects.all().delete()
+    ShoppingListItem.objects.bulk_create((
+        ShoppingListItem(
+            user_id=row['recipe__selected_recipes__user'],
+            ingredient_id=row['ingredient'],
+            name=row['ingredient__name'], unit=row['ingredient__unit'],
+            total=row['total'], recipes_count=row['recipes']
+        )
+        for row in totals.iterator()
+    ), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_fill_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_shopping_lists, migrations.RunPython.noop),
+    ]
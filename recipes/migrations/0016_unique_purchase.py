@@ -0,0 +1,66 @@
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def remove_duplicate_purchases(apps, schema_editor):
+    """
+    Keeps the first purchase of every (user, recipe) pair and recounts
+    the purchases_count and the shopping lists the duplicates inflated
+    """
+    Purchase = apps.get_model('recipes', 'Purchase')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Amount = apps.get_model('recipes', 'Amount')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    duplicates = Purchase.objects.order_by().values(
+        'user', 'recipe'
+    ).annotate(first=Min('pk'), total=Count('pk')).filter(total__gt=1)
+    user_ids, recipe_ids = set(), set()
+    for row in duplicates.iterator():
+        Purchase.objects.filter(
+            user=row['user'], recipe=row['recipe']
+        ).exclude(pk=row['first']).delete()
+        user_ids.add(row['user'])
+        recipe_ids.add(row['recipe'])
+    if not user_ids:
+        return
+
+    recipes = Recipe._default_manager.filter(pk__in=recipe_ids).annotate(
+        purchases=Count('selected_recipes'))
+    for recipe in recipes:
+        recipe.purchases_count = recipe.purchases
+    Recipe._default_manager.bulk_update(recipes, ['purchases_count'])
+
+    ShoppingListItem.objects.filter(user__in=user_ids).delete()
+    totals = Amount._default_manager.filter(
+        recipe__selected_recipes__user__in=user_ids
+    ).order_by().values(
+        'recipe__selected_recipes__user', 'ingredient',
+        'ingredient__name', 'ingredient__unit'
+    ).annotate(
+        total=Sum('units'), recipes=Count('recipe', distinct=True)
+    )
+    ShoppingListItem.objects.bulk_create((
+        ShoppingListItem(
+            user_id=row['recipe__selected_recipes__user'],
+            ingredient_id=row['ingredient'],
+            name=row['ingredient__name'], unit=row['ingredient__unit'],
+            total=row['total'], recipes_count=row['recipes']
+        )
+        for row in totals.iterator()
+    ), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_fill_shopping_lists'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_purchases,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='purchase',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_purchase'),
+        ),
+    ]
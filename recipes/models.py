@@ -1,12 +1,15 @@
 from django.contrib.auth import get_user_model
-from django.core.exceptions import ObjectDoesNotExist, ValidationError
-from django.core.validators import MinValueValidator
+from django.core.exceptions import ValidationError
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 
 from .validators import image_size_validator
 
 User = get_user_model()
 
+# Bits of the signed 64-bit Recipe.tag_mask available to the tags
+TAG_BITS = 63
+
 
 class Tag(models.Model):
     """
@@ -20,6 +23,10 @@ class Tag(models.Model):
             models.UniqueConstraint(
                 fields=['name', 'checkbox_style'],
                 name='unique_tag'
+            ),
+            models.CheckConstraint(
+                check=models.Q(bit_position__lt=TAG_BITS),
+                name='tag_bit_position_range'
             )]
 
     name = models.CharField(
@@ -35,10 +42,41 @@ class Tag(models.Model):
         verbose_name='цвет тега',
         max_length=20
     )
+    bit_position = models.PositiveSmallIntegerField(
+        verbose_name='Бит тега в маске рецепта',
+        unique=True,
+        editable=False,
+        validators=[MaxValueValidator(TAG_BITS - 1)]
+    )
 
     def __str__(self):
         return self.name
 
+    @staticmethod
+    def get_free_bit_position():
+        """
+        The lowest bit of Recipe.tag_mask not taken by a tag or None
+        """
+        taken = set(Tag.objects.values_list('bit_position', flat=True))
+        return next(
+            (position for position in range(TAG_BITS)
+             if position not in taken), None
+        )
+
+    def clean(self):
+        if (self.bit_position is None
+                and self.get_free_bit_position() is None):
+            raise ValidationError(
+                f'Нельзя создать больше {TAG_BITS} тегов'
+            )
+
+    @property
+    def bit(self):
+        """
+        The bit of the tag in the Recipe.tag_mask column
+        """
+        return 1 << self.bit_position
+
 
 class Ingredient(models.Model):
     """
@@ -70,14 +108,24 @@ class RecipeManager(models.Manager):
     """
 
     def filter_by_tags(self, tag):
+        queryset = self.get_queryset()
         if tag:
-            queryset = Recipe.objects.filter(
-                tag__name__in=tag.split(
-                    ',')).distinct()
-        else:
-            queryset = Recipe.objects.all()
+            tags = Tag.objects.filter(name__in=tag.split(','))
+            queryset = self.with_tag_mask(
+                queryset, sum(tag.bit for tag in tags)
+            )
         return queryset
 
+    @staticmethod
+    def with_tag_mask(queryset, mask):
+        """
+        Recipes having at least one of the tags of the mask.
+        A single bitwise predicate on the recipe table, no join.
+        """
+        return queryset.annotate(
+            tag_match=models.F('tag_mask').bitand(mask)
+        ).exclude(tag_match=0)
+
 
 class Recipe(models.Model):
     """
@@ -85,9 +133,13 @@ class Recipe(models.Model):
     """
 
     class Meta:
-        ordering = ('-pub_date',)
+        ordering = ('-pub_date', '-id')
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+        ]
 
     author = models.ForeignKey(
         User,
@@ -107,6 +159,11 @@ class Recipe(models.Model):
         validators=[image_size_validator]
 
     )
+    image_variants = models.JSONField(
+        verbose_name='Размеры изображения',
+        default=dict,
+        editable=False,
+    )
     description = models.TextField(
         verbose_name='Описание рецепта',
         max_length=1000,
@@ -142,12 +199,47 @@ class Recipe(models.Model):
         verbose_name='Тэг',
         related_name='recipe_tags'
     )
+    tag_mask = models.BigIntegerField(
+        verbose_name='Битовая маска тегов',
+        default=0,
+        editable=False
+    )
+    card_version = models.PositiveIntegerField(
+        verbose_name='Версия карточки',
+        default=0,
+        editable=False
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Количество добавлений в избранное',
+        default=0,
+        editable=False
+    )
+    purchases_count = models.PositiveIntegerField(
+        verbose_name='Количество добавлений в покупки',
+        default=0,
+        editable=False
+    )
 
     recipes = RecipeManager()
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        """
+        Every update of the recipe invalidates its cached card
+        """
+        if self.pk is None:
+            return super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'card_version'}
+        self.card_version = models.F('card_version') + 1
+        super().save(*args, **kwargs)
+        # Deferred instead of reloaded: the version is read from the
+        # database only if this instance renders its card afterwards
+        del self.__dict__['card_version']
+
     @property
     def image_url(self):
         if self.image and hasattr(self.image, 'url'):
@@ -193,6 +285,12 @@ class Purchase(models.Model):
     class Meta:
         verbose_name = 'Покупка'
         verbose_name_plural = 'Покупки'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_purchase'
+            ),
+        ]
 
     user = models.ForeignKey(
         User,
@@ -211,6 +309,56 @@ class Purchase(models.Model):
         return self.recipe.name
 
 
+class ShoppingListItem(models.Model):
+    """
+    Total of an ingredient over the recipes in the user's shopping list.
+    The rows are kept up to date when the purchases and the recipes change,
+    the name and the unit are copied from the ingredient.
+    """
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Позиции списка покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            ),
+        ]
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Покупатель',
+        related_name='shopping_list'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+        related_name='shopping_list_items'
+    )
+    name = models.CharField(
+        verbose_name='Название ингредиента',
+        max_length=200,
+    )
+    unit = models.CharField(
+        verbose_name='Единица измерения',
+        max_length=20,
+    )
+    total = models.PositiveIntegerField(
+        verbose_name='Количество',
+        default=0,
+    )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Количество рецептов',
+        default=0,
+    )
+
+    def __str__(self):
+        return f'{self.name} - {self.total} {self.unit}'
+
+
 class Follow(models.Model):
     """
     model Follow
@@ -248,20 +396,79 @@ class Follow(models.Model):
         return f'{self.user.name} подписался на {self.author.name}'
 
 
+class FeedEntry(models.Model):
+    """
+    Recipe in the feed of a follower of its author.
+    The entries are written when a recipe is published. The recipes
+    of the authors with too many followers get no entries, the feed
+    reads them from the recipes instead.
+    """
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_entry'
+            ),
+        ]
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        verbose_name='Подписчик'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт'
+    )
+
+    def __str__(self):
+        return f'{self.user} - {self.recipe}'
+
+
+class AuthorCounter(models.Model):
+    """
+    Denormalized counters of the author
+    """
+
+    class Meta:
+        verbose_name = 'Счетчик автора'
+        verbose_name_plural = 'Счетчики авторов'
+
+    author = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='counter',
+        verbose_name='Автор'
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Количество подписчиков',
+        default=0
+    )
+
+    def __str__(self):
+        return f'{self.author}: {self.followers_count}'
+
+
 class FavoriteManager(models.Manager):
     """Менеджер модели избранное."""
 
     def get_favorites(self, user):
         """
-        Фукция возвращает QuerySet рецептов добавленных в избранное. Если таких
-        рецепров нет возвращает пустой лист.
+        Возвращает QuerySet рецептов, добавленных пользователем в избранное.
+        Идентификаторы рецептов берутся из кэша.
         """
+        from .cache import get_id_set
 
-        try:
-            return super().get_queryset().get(
-                user=user).recipes.all()
-        except ObjectDoesNotExist:
-            return []
+        return Recipe.recipes.filter(
+            pk__in=list(get_id_set(user.pk, 'favorites'))
+        )
 
 
 class Favorite(models.Model):
@@ -0,0 +1,106 @@
+import base64
+import binascii
+import datetime
+
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+
+
+class CursorPage:
+    """
+    A page of the keyset paginator with opaque tokens
+    for the next and previous pages
+    """
+
+    is_cursor = True
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Keyset paginator over the (pub_date, id) pair.
+    Each page is a range scan of the index from the cursor position,
+    so neither a COUNT nor an OFFSET is needed however deep the page is.
+    """
+
+    next_direction = 'n'
+    previous_direction = 'p'
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+
+    @staticmethod
+    def encode_cursor(direction, obj):
+        raw = f'{direction}{obj.pub_date.isoformat()}|{obj.pk}'
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            padding = '=' * (-len(cursor) % 4)
+            raw = base64.urlsafe_b64decode(cursor + padding).decode()
+            direction, raw = raw[0], raw[1:]
+            pub_date, pk = raw.split('|')
+            return (direction, datetime.date.fromisoformat(pub_date),
+                    int(pk))
+        except (binascii.Error, UnicodeDecodeError, IndexError, ValueError):
+            raise InvalidPage('Неверный курсор страницы')
+
+    def page(self, cursor=None):
+        queryset = self.queryset
+        direction = self.next_direction
+        if cursor:
+            direction, pub_date, pk = self.decode_cursor(cursor)
+            if direction == self.next_direction:
+                queryset = queryset.filter(
+                    Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, pk__lt=pk)
+                )
+            elif direction == self.previous_direction:
+                queryset = queryset.filter(
+                    Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, pk__gt=pk)
+                )
+            else:
+                raise InvalidPage('Неверный курсор страницы')
+
+        if direction == self.next_direction:
+            queryset = queryset.order_by('-pub_date', '-pk')
+        else:
+            queryset = queryset.order_by('pub_date', 'pk')
+        object_list = list(queryset[:self.per_page + 1])
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+
+        if direction == self.previous_direction:
+            object_list.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, bool(cursor)
+
+        next_cursor = previous_cursor = None
+        if object_list and has_next:
+            next_cursor = self.encode_cursor(
+                self.next_direction, object_list[-1])
+        if object_list and has_previous:
+            previous_cursor = self.encode_cursor(
+                self.previous_direction, object_list[0])
+        return CursorPage(object_list, next_cursor, previous_cursor)
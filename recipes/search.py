@@ -0,0 +1,172 @@
+import heapq
+import math
+import threading
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from recipes.models import Ingredient
+
+from .cache import bump_catalog_version, get_catalog_version
+
+
+class CatalogIndex(ABC):
+    """
+    Base class of the process-local ingredient indexes.
+    The index is built on first use and rebuilt when the catalog version
+    differs from the one it was built for.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+        self._generation = 0
+
+    def invalidate(self):
+        self._generation += 1
+        self._data = None
+
+    @abstractmethod
+    def build(self, rows):
+        """
+        Builds the index data from (name, unit) pairs
+        """
+
+    @abstractmethod
+    def lookup(self, data, query, limit):
+        """
+        Returns up to limit (name, unit) pairs matching the case-folded query
+        """
+
+    def _get_data(self):
+        version = get_catalog_version()
+        data = self._data
+        if data is None or data[0] != version:
+            with self._lock:
+                data = self._data
+                if data is None or data[0] != version:
+                    generation = self._generation
+                    rows = Ingredient.objects.order_by().values_list(
+                        'name', 'unit')
+                    data = (version, self.build(rows))
+                    if generation == self._generation:
+                        self._data = data
+        return data
+
+    def search(self, query, limit):
+        query = (query or '').strip().casefold()
+        if not query:
+            return []
+        return self.lookup(self._get_data()[1], query, limit)
+
+
+class IngredientPrefixIndex(CatalogIndex):
+    """
+    Index for the ingredient autocomplete.
+    Case-folded names are kept in a sorted list, so a prefix lookup is
+    a binary search followed by a scan of the matching run only.
+    """
+
+    def build(self, rows):
+        entries = sorted(
+            (name.casefold(), name, unit) for name, unit in rows
+        )
+        keys = [key for key, _, _ in entries]
+        items = [(name, unit) for _, name, unit in entries]
+        return keys, items
+
+    def lookup(self, data, query, limit):
+        keys, items = data
+        results = []
+        position = bisect_left(keys, query)
+        while (position < len(keys) and len(results) < limit
+               and keys[position].startswith(query)):
+            results.append(items[position])
+            position += 1
+        return results
+
+
+def trigrams(text):
+    """
+    Trigrams of the case-folded words padded the same way as pg_trgm does
+    """
+    result = set()
+    for word in text.casefold().split():
+        word = f'  {word} '
+        result.update(word[i:i + 3] for i in range(len(word) - 2))
+    return result
+
+
+class IngredientTrigramIndex(CatalogIndex):
+    """
+    Typo-tolerant index: an inverted index from every trigram to the
+    ingredients containing it. Results are ranked by the trigram
+    similarity |A & B| / |A | B|, the same measure as pg_trgm uses.
+    """
+
+    similarity_threshold = 0.3
+
+    def build(self, rows):
+        items, sizes = [], array('H')
+        postings = defaultdict(lambda: array('I'))
+        for position, (name, unit) in enumerate(rows):
+            grams = trigrams(name)
+            items.append((name, unit))
+            sizes.append(len(grams))
+            for gram in grams:
+                postings[gram].append(position)
+        return dict(postings), sizes, items
+
+    def lookup(self, data, query, limit):
+        postings, sizes, items = data
+        grams = trigrams(query)
+        if not grams:
+            return []
+        shared = Counter()
+        for gram in grams:
+            if gram in postings:
+                shared.update(postings[gram])
+
+        threshold = self.similarity_threshold
+        # the similarity never exceeds shared / len(grams), so the entries
+        # sharing fewer trigrams than this can not reach the threshold
+        min_shared = math.ceil(threshold * len(grams) - 1e-9)
+        scored = []
+        for position, count in shared.items():
+            if count < min_shared:
+                continue
+            similarity = count / (len(grams) + sizes[position] - count)
+            if similarity >= threshold:
+                scored.append((similarity, -sizes[position], -position))
+        return [items[-position]
+                for _, _, position in heapq.nlargest(limit, scored)]
+
+
+ingredient_index = IngredientPrefixIndex()
+ingredient_trigram_index = IngredientTrigramIndex()
+
+
+def invalidate_catalog():
+    """
+    Bumps the catalog version shared by the processes and drops the indexes
+    of this one, called once the catalog change is committed
+    """
+    bump_catalog_version()
+    ingredient_index.invalidate()
+    ingredient_trigram_index.invalidate()
+
+
+def search_ingredients(query, limit):
+    """
+    Prefix matches go first, the remaining places are taken
+    by the fuzzy matches ranked by similarity
+    """
+    results = ingredient_index.search(query, limit)
+    if len(results) < limit:
+        found = set(results)
+        results.extend(
+            item for item in ingredient_trigram_index.search(query, limit)
+            if item not in found
+        )
+    return results[:limit]
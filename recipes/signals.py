@@ -0,0 +1,180 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from recipes.models import (TAG_BITS, Ingredient, Purchase, Recipe,
+                            ShoppingListItem, Tag, User)
+
+from .cache import change_purchases_count, invalidate_pages
+from .images import schedule_image_variants
+from .search import invalidate_catalog
+from .util import (bump_card_versions, change_recipe_shopping_lists,
+                   get_recipe_shopping_changes, update_tag_masks)
+
+
+def _invalidate_pages_on_commit(*names):
+    """
+    Bumps the generations once the change is committed, a page rendered
+    by a concurrent request before the commit must not be cached under
+    the new generation
+    """
+    transaction.on_commit(lambda: invalidate_pages(*names))
+
+
+def _invalidate_recipe_pages(author_ids):
+    _invalidate_pages_on_commit(
+        'recipes', *(f'author:{author_id}' for author_id in set(author_ids))
+    )
+
+
+@receiver(m2m_changed, sender=Recipe.tag.through)
+def sync_tag_mask(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keeps Recipe.tag_mask in sync with the tag relation
+    """
+    if reverse and action == 'pre_clear':
+        instance._cleared_recipe_ids = list(
+            instance.recipe_tags.values_list('pk', flat=True)
+        )
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        recipe_ids = [instance.pk]
+    elif action == 'post_clear':
+        recipe_ids = getattr(instance, '_cleared_recipe_ids', [])
+    else:
+        recipe_ids = pk_set
+    update_tag_masks(recipe_ids)
+    if reverse:
+        author_ids = Recipe.recipes.filter(
+            pk__in=recipe_ids
+        ).values_list('author_id', flat=True)
+    else:
+        author_ids = [instance.author_id]
+    _invalidate_recipe_pages(author_ids)
+
+
+@receiver(pre_save, sender=Tag)
+def assign_tag_bit(sender, instance, **kwargs):
+    """
+    Gives a new tag the lowest free bit of Recipe.tag_mask,
+    the bits of the deleted tags are reused
+    """
+    if instance.bit_position is None:
+        instance.bit_position = instance.get_free_bit_position()
+        if instance.bit_position is None:
+            raise ValidationError(
+                f'Нельзя создать больше {TAG_BITS} тегов'
+            )
+
+
+@receiver(pre_delete, sender=Tag)
+def clear_tag_bit(sender, instance, **kwargs):
+    """
+    Removes the bit of a deleted tag from the recipes
+    """
+    Recipe.recipes.exclude(
+        tag_mask=F('tag_mask').bitand(~instance.bit)
+    ).update(
+        tag_mask=F('tag_mask').bitand(~instance.bit),
+        card_version=F('card_version') + 1
+    )
+
+
+@receiver(post_save, sender=Tag)
+def invalidate_tag_cards(sender, instance, created, **kwargs):
+    """
+    Invalidates the cached cards of the recipes with a changed tag
+    """
+    if not created:
+        bump_card_versions(Recipe.recipes.with_tag_mask(
+            Recipe.recipes.all(), instance.bit
+        ))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag_pages(sender, instance, **kwargs):
+    """
+    Every recipe page renders the list of tags
+    """
+    _invalidate_pages_on_commit('tags')
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe_pages(sender, instance, **kwargs):
+    _invalidate_recipe_pages([instance.author_id])
+
+
+@receiver(post_save, sender=Recipe)
+def build_image_variants(sender, instance, update_fields, **kwargs):
+    """
+    Generates the image variants in the background after the upload
+    """
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    # The default image is a static file, not in the media storage
+    default = Recipe._meta.get_field('image').default
+    if instance.image and instance.image.name != default:
+        schedule_image_variants(instance.image.name)
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_from_shopping_lists(sender, instance, **kwargs):
+    """
+    Takes the amounts of a deleted recipe out of the shopping lists
+    before the cascade removes its purchases and amounts
+    """
+    change_recipe_shopping_lists(
+        instance.pk, get_recipe_shopping_changes(instance.pk, sign=-1)
+    )
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_cards(sender, instance, created, update_fields,
+                            **kwargs):
+    """
+    Invalidates the cached cards of an author whose name may have changed
+    """
+    name_fields = {'first_name', 'last_name'}
+    if created or (update_fields and not name_fields & set(update_fields)):
+        return
+    bump_card_versions(Recipe.recipes.filter(author=instance))
+    _invalidate_recipe_pages([instance.pk])
+
+
+@receiver(post_save, sender=Purchase)
+def increment_purchases_count(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(
+            lambda: change_purchases_count(instance.user_id, 1)
+        )
+
+
+@receiver(post_delete, sender=Purchase)
+def decrement_purchases_count(sender, instance, **kwargs):
+    transaction.on_commit(
+        lambda: change_purchases_count(instance.user_id, -1)
+    )
+
+
+@receiver(post_save, sender=Ingredient)
+def rename_shopping_list_items(sender, instance, created, **kwargs):
+    if not created:
+        ShoppingListItem.objects.filter(ingredient=instance).exclude(
+            name=instance.name, unit=instance.unit
+        ).update(name=instance.name, unit=instance.unit)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_index(sender, instance, **kwargs):
+    """
+    A request served before the commit must not build the index
+    from the old rows under the new catalog version
+    """
+    transaction.on_commit(invalidate_catalog)
@@ -1,6 +1,7 @@
 from django import template
 
-from recipes.models import Favorite, Follow, Purchase
+from recipes.cache import get_purchases_count
+from recipes.images import get_image_sources
 
 register = template.Library()
 
@@ -28,24 +29,20 @@ def get_filter_link(request, tag):
 def url_replace(request, page, new_page):
     query = request.GET.copy()
     query[page] = new_page
+    if page == 'cursor':
+        query.pop('page', None)
     return query.urlencode()
 
 
 @register.filter(name='shopping_count')
 def shopping_count(request, user_id):
-    return Purchase.objects.filter(user=user_id).count()
+    return get_purchases_count(user_id)
 
 
-@register.filter(name='shopping_recipe')
-def shopping_recipe(recipe, user):
-    return Purchase.objects.filter(user=user, recipe=recipe).exists()
-
-
-@register.filter(name='is_following')
-def is_following(author, user):
-    return Follow.objects.filter(user=user, author=author).exists()
-
-
-@register.filter(name='is_favorite')
-def is_favorite(recipe, user):
-    return Favorite.favorite.filter(user=user, recipe=recipe).exists()
+@register.inclusion_tag('includes/recipe_image.html')
+def recipe_image(recipe, variant, class_name, alt=''):
+    return {
+        **get_image_sources(recipe, variant),
+        'class_name': class_name,
+        'alt': alt,
+    }
@@ -0,0 +1,76 @@
+from collections import namedtuple
+
+from django.db.models import Case, CharField, F, IntegerField, Value, When
+
+Unit = namedtuple('Unit', 'dimension factor')
+
+MASS, VOLUME, TO_TASTE = 'mass', 'volume', 'по вкусу'
+
+# Every unit of the ingredient catalog (recipes/fixtures/ingredients.csv).
+# The amounts of one dimension are summed up in its base unit, the one
+# with the factor 1. The counted units are a dimension of their own.
+UNITS = {
+    'г': Unit(MASS, 1),
+    'кг': Unit(MASS, 1000),
+    'мл': Unit(VOLUME, 1),
+    'л': Unit(VOLUME, 1000),
+    'ч. л.': Unit(VOLUME, 5),
+    'ст. л.': Unit(VOLUME, 15),
+    'стакан': Unit(VOLUME, 200),
+    'по вкусу': Unit(TO_TASTE, 0),
+    **{unit: Unit(unit, 1) for unit in (
+        'шт.', 'горсть', 'щепотка', 'упаковка', 'банка', 'кусок', 'пакет',
+        'капля', 'пучок', 'веточка', 'тушка', 'стручок', 'бутылка',
+        'пакетик', 'звездочка', 'долька', 'зубчик', 'пласт', 'пачка',
+        'батон', 'лист', 'стебель', '',
+    )},
+}
+
+# Units the mixed totals of a dimension are shown in, the largest first
+DISPLAY_UNITS = {
+    MASS: ('кг', 'г'),
+    VOLUME: ('л', 'мл'),
+}
+
+
+def unit_dimension(field):
+    """
+    Database expression of the dimension of the unit in the field,
+    an unknown unit is a dimension of its own
+    """
+    return Case(
+        *(When(**{field: unit}, then=Value(spec.dimension))
+          for unit, spec in UNITS.items() if spec.dimension != unit),
+        default=F(field),
+        output_field=CharField()
+    )
+
+
+def unit_factor(field):
+    """
+    Database expression converting the unit in the field to its base unit
+    """
+    return Case(
+        *(When(**{field: unit}, then=Value(spec.factor))
+          for unit, spec in UNITS.items() if spec.factor != 1),
+        default=Value(1),
+        output_field=IntegerField()
+    )
+
+
+def format_quantity(dimension, total, first_unit, last_unit):
+    """
+    Renders a total in base units back in human units.
+    A total of a single unit is shown in that unit, a mixed one
+    in the largest display unit it reaches.
+    """
+    if dimension == TO_TASTE:
+        return TO_TASTE
+    unit = first_unit
+    if first_unit != last_unit:
+        units = DISPLAY_UNITS[dimension]
+        unit = next((unit for unit in units if total >= UNITS[unit].factor),
+                    units[-1])
+    factor = UNITS[unit].factor if unit in UNITS else 1
+    value = f'{total / factor:.2f}'.rstrip('0').rstrip('.').replace('.', ',')
+    return f'{value} {unit}'.rstrip()
@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadhandler import (SkipFile,
+                                             TemporaryFileUploadHandler)
+
+from .validators import check_image_header
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    """
+    Streams the uploaded images straight to temporary files.
+    An upload is dropped as soon as it grows past MAX_IMAGE_UPLOAD_SIZE
+    and a complete one is checked by its header only, so the memory used
+    per upload does not depend on the size of the attempted upload.
+    The reasons of the dropped uploads are kept in request.upload_errors.
+    Only the recipe form views install it, see RecipeFormMixin.dispatch.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        request.upload_errors = {}
+
+    def _reject(self, message):
+        self.request.upload_errors[self.field_name] = message
+        if self.file is not None:
+            self.file.close()
+        raise SkipFile()
+
+    def _reject_size(self):
+        self._reject(
+            'Максимальный размер изображения не должен превышать %s MB'
+            % (settings.MAX_IMAGE_UPLOAD_SIZE // (1024 * 1024))
+        )
+
+    def new_file(self, field_name, file_name, content_type, content_length,
+                 charset=None, content_type_extra=None):
+        self.field_name, self.file = field_name, None
+        self.received = 0
+        if (content_length is not None
+                and content_length > settings.MAX_IMAGE_UPLOAD_SIZE):
+            self._reject_size()
+        super().new_file(field_name, file_name, content_type, content_length,
+                         charset, content_type_extra)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.MAX_IMAGE_UPLOAD_SIZE:
+            self._reject_size()
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        try:
+            check_image_header(self.file)
+        except ValidationError as error:
+            self.request.upload_errors[self.field_name] = error.messages[0]
+            self.file.close()
+            return None
+        return super().file_complete(file_size)
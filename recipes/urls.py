@@ -1,11 +1,11 @@
 from django.urls import path
 
-from recipes.views import (AuthorRecipeListView, FavoriteListView,
-                           FavoriteView, FollowListView, GetIngredientsView,
-                           PurchaseList, PurchasesView, RecipeCreateView,
-                           RecipeDeleteView, RecipeDetailView, RecipeListView,
-                           RecipeUpdateView, SubscribeView,
-                           purchaselist_download)
+from recipes.views import (AuthorRecipeListView, BatchView, FavoriteListView,
+                           FavoriteView, FeedListView, FollowListView,
+                           GetIngredientsView, PurchaseList, PurchasesView,
+                           RecipeCreateView, RecipeDeleteView,
+                           RecipeDetailView, RecipeListView, RecipeUpdateView,
+                           SubscribeView, purchaselist_download)
 
 urlpatterns = [
     # recipes
@@ -23,6 +23,7 @@ urlpatterns = [
          FavoriteView.as_view(), name='remove_favorites'),
     # subscriptions
     path('subscriptionslist/', FollowListView.as_view(), name='subscriptions'),
+    path('feed/', FeedListView.as_view(), name='feed'),
     path('subscriptions/', SubscribeView.as_view(), name='add_subscription'),
     path('subscriptions/<int:author_id>/',
          SubscribeView.as_view(), name='remove_subscriptions'),
@@ -34,4 +35,6 @@ urlpatterns = [
          PurchasesView.as_view(), name='remove_purchases'),
     path('shoplist/download/',
          purchaselist_download, name='purchaselist_download'),
+    # batch of favorites, purchases and subscriptions changes
+    path('batch/', BatchView.as_view(), name='batch'),
 ]
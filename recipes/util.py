@@ -1,36 +1,342 @@
-from django.shortcuts import get_object_or_404
+from django.db.models import (CharField, Count, F, IntegerField, Max, Min,
+                              Sum, Value, Window)
+from django.db.models.functions import Greatest, RowNumber
 
-from recipes.models import Amount, Ingredient, Tag
+from recipes.models import (Amount, Ingredient, Purchase, Recipe,
+                            ShoppingListItem, Tag)
 
+from .cache import get_id_set
+from .units import unit_dimension, unit_factor
 
-def create_ingredients_amounts(instance, form_data):
 
-    names = [
-        value for name, value in form_data.items()
-        if name.startswith('nameIngredient_')
-    ]
-    units = [
-        value for name, value in form_data.items()
-        if name.startswith('valueIngredient_')
+def get_form_ingredients(form_data):
+    """
+    Collects {name: units} from the nameIngredient_N and valueIngredient_N
+    fields of the recipe form, the units of repeated names are summed up.
+    Raises ValueError if the units are not a non-negative integer.
+    """
+    ingredients = {}
+    for key, name in form_data.items():
+        if not key.startswith('nameIngredient_'):
+            continue
+        number = key[len('nameIngredient_'):]
+        units = int(form_data.get(f'valueIngredient_{number}', ''))
+        if units < 0:
+            raise ValueError(units)
+        ingredients[name] = ingredients.get(name, 0) + units
+    return ingredients
+
+
+def resolve_ingredients(names):
+    """
+    Resolves the ingredient names with a single query.
+    Returns the name -> id map and the list of unknown names.
+    """
+    ingredient_ids = dict(Ingredient.objects.filter(
+        name__in=set(names)
+    ).values_list('name', 'id'))
+    unknown = [name for name in names if name not in ingredient_ids]
+    return ingredient_ids, unknown
+
+
+def create_ingredients_amounts(instance, amounts):
+    """
+    Creates the Amount rows of the recipe from {ingredient_id: units}
+    """
+    Amount.objects.bulk_create(
+        Amount(recipe=instance, ingredient_id=ingredient_id, units=units)
+        for ingredient_id, units in amounts.items()
+    )
+
+
+def sync_ingredients_amounts(instance, amounts):
+    """
+    Brings the Amount rows of the recipe to {ingredient_id: units}
+    issuing only the inserts, updates and deletes that are needed.
+    Returns the changes of the shopping lists containing the recipe.
+    """
+    existing, stale, old_totals = {}, [], {}
+    rows = instance.amount_recipes.values_list('pk', 'ingredient_id', 'units')
+    for pk, ingredient_id, units in rows:
+        old_totals[ingredient_id] = old_totals.get(ingredient_id, 0) + units
+        if ingredient_id in existing or ingredient_id not in amounts:
+            stale.append(pk)
+        else:
+            existing[ingredient_id] = Amount(
+                pk=pk, recipe=instance, ingredient_id=ingredient_id,
+                units=units
+            )
+
+    changed = []
+    for ingredient_id, amount in existing.items():
+        if amount.units != amounts[ingredient_id]:
+            amount.units = amounts[ingredient_id]
+            changed.append(amount)
+    created = [
+        Amount(recipe=instance, ingredient_id=ingredient_id, units=units)
+        for ingredient_id, units in amounts.items()
+        if ingredient_id not in existing
     ]
-    ingredients_amounts = [
-        Amount(
-            ingredient=get_object_or_404(Ingredient, name=ingredient),
-            units=int(unit),
-            recipe=instance
+
+    if stale:
+        Amount.objects.filter(pk__in=stale).delete()
+    if changed:
+        Amount.objects.bulk_update(changed, ['units'])
+    if created:
+        Amount.objects.bulk_create(created)
+    return {
+        ingredient_id: (
+            amounts.get(ingredient_id, 0) - old_totals.get(ingredient_id, 0),
+            (ingredient_id in amounts) - (ingredient_id in old_totals)
         )
-        for ingredient, unit in zip(names, units)
-    ]
-    Amount.objects.bulk_create(ingredients_amounts)
+        for ingredient_id in {*amounts, *old_totals}
+    }
 
 
 def get_all_tags():
     return Tag.objects.all()
 
 
+def get_card_queryset(queryset):
+    """
+    Loads the authors and tags of the recipe cards eagerly
+    and skips the description that the cards never show.
+    """
+    return queryset.select_related('author').prefetch_related(
+        'tag').defer('description')
+
+
+def get_latest_recipes(author_ids, limit=3):
+    """
+    Returns {author_id: (latest recipes, number of recipes)} for the authors.
+    The recipes are ranked per author by a window function, so the whole
+    page of authors is read in one query.
+    """
+    latest = {author_id: ([], 0) for author_id in author_ids}
+    if not latest:
+        return latest
+    ranked = Recipe.recipes.filter(author_id__in=latest).order_by().annotate(
+        position=Window(
+            RowNumber(), partition_by=[F('author_id')],
+            order_by=[F('pub_date').desc(), F('id').desc()]
+        ),
+        recipes_count=Window(Count('id'), partition_by=[F('author_id')])
+    )
+    sql, params = ranked.query.sql_with_params()
+    recipes = Recipe.recipes.raw(
+        f'SELECT * FROM ({sql}) ranked WHERE position <= %s '
+        f'ORDER BY author_id, position', (*params, limit)
+    )
+    for recipe in recipes:
+        latest[recipe.author_id] = (
+            latest[recipe.author_id][0] + [recipe], recipe.recipes_count
+        )
+    return latest
+
+
 def get_filters(request, queryset):
     filters = request.GET.getlist('filters')
     if filters:
-        qs = queryset.filter(tag__slug__in=filters).distinct()
-        return qs
+        tags = Tag.objects.filter(slug__in=filters)
+        return Recipe.recipes.with_tag_mask(
+            queryset, sum(tag.bit for tag in tags)
+        )
     return queryset
+
+
+def update_tag_masks(recipe_ids):
+    """
+    Recomputes Recipe.tag_mask of the given recipes from the tag relation
+    and invalidates their cached cards
+    """
+    masks = dict.fromkeys(recipe_ids, 0)
+    bits = {tag.pk: tag.bit for tag in Tag.objects.all()}
+    links = Recipe.tag.through.objects.filter(
+        recipe__in=masks
+    ).values_list('recipe_id', 'tag_id')
+    for recipe_id, tag_id in links:
+        masks[recipe_id] |= bits[tag_id]
+    for recipe_id, mask in masks.items():
+        Recipe.recipes.filter(pk=recipe_id).update(
+            tag_mask=mask, card_version=F('card_version') + 1
+        )
+
+
+def get_viewer_state(user, recipes, authors=()):
+    """
+    Returns the ids of the favorite, purchased recipes and followed authors
+    of the current user among the given recipes and authors.
+    The cached id sets of the user are read, so a page with a warm cache
+    queries nothing.
+    """
+    state = {'favorites': set(), 'purchases': set(), 'following': set()}
+    if not user.is_authenticated:
+        return state
+
+    recipes = list(recipes)
+    recipe_ids = {recipe.id for recipe in recipes}
+    author_ids = {recipe.author_id for recipe in recipes}
+    author_ids.update(author.id for author in authors)
+
+    for kind, ids in (('favorites', recipe_ids), ('purchases', recipe_ids),
+                      ('following', author_ids)):
+        if ids:
+            id_set = get_id_set(user.pk, kind)
+            state[kind] = {pk for pk in ids if pk in id_set}
+    return state
+
+
+def bump_card_versions(queryset):
+    """
+    Invalidates the cached cards of the recipes
+    """
+    queryset.update(card_version=F('card_version') + 1)
+
+
+def change_recipe_counter(recipe_id, field, delta):
+    """
+    Atomically shifts the favorites_count or purchases_count of the recipe,
+    a counter that missed some rows never drops below zero
+    """
+    change_recipe_counters([recipe_id], field, delta)
+
+
+def change_recipe_counters(recipe_ids, field, delta):
+    Recipe.recipes.filter(pk__in=recipe_ids).update(
+        **{field: Greatest(F(field) + delta, 0)}
+    )
+
+
+def get_recipe_shopping_changes(recipe_id, sign=1):
+    """
+    Returns the {ingredient_id: (units, recipes)} changes of a shopping list
+    the recipe is added to (sign=1) or removed from (sign=-1)
+    """
+    return get_shopping_changes({recipe_id: sign})
+
+
+def get_shopping_changes(signs):
+    """
+    Returns the changes of a shopping list the recipes of the
+    {recipe_id: sign} mapping are added to or removed from, in one query
+    """
+    changes, counted = {}, set()
+    amounts = Amount.objects.filter(recipe_id__in=signs).values_list(
+        'recipe_id', 'ingredient_id', 'units')
+    for recipe_id, ingredient_id, units in amounts:
+        sign = signs[recipe_id]
+        total, recipes = changes.get(ingredient_id, (0, 0))
+        if (recipe_id, ingredient_id) not in counted:
+            counted.add((recipe_id, ingredient_id))
+            recipes += sign
+        changes[ingredient_id] = (total + sign * units, recipes)
+    return changes
+
+
+def change_shopping_lists(user_ids, changes):
+    """
+    Applies the {ingredient_id: (units, recipes)} changes to the shopping
+    lists of the users. A row is created for an ingredient new to a list
+    and deleted once no recipe of the list uses the ingredient.
+    """
+    user_ids = list(user_ids)
+    changes = {
+        ingredient_id: change for ingredient_id, change in changes.items()
+        if change != (0, 0)
+    }
+    if not user_ids or not changes:
+        return
+    rows = {
+        (row.user_id, row.ingredient_id): row
+        for row in ShoppingListItem.objects.select_for_update().filter(
+            user_id__in=user_ids, ingredient_id__in=changes
+        )
+    }
+    updated, deleted, missing = [], [], []
+    for user_id in user_ids:
+        for ingredient_id, (units, recipes) in changes.items():
+            row = rows.get((user_id, ingredient_id))
+            if row is None:
+                if recipes > 0:
+                    missing.append((user_id, ingredient_id))
+                continue
+            row.total = max(row.total + units, 0)
+            row.recipes_count = max(row.recipes_count + recipes, 0)
+            if row.recipes_count:
+                updated.append(row)
+            else:
+                deleted.append(row.pk)
+
+    if deleted:
+        ShoppingListItem.objects.filter(pk__in=deleted).delete()
+    if updated:
+        ShoppingListItem.objects.bulk_update(
+            updated, ['total', 'recipes_count']
+        )
+    if missing:
+        ingredients = {
+            pk: (name, unit) for pk, name, unit in
+            Ingredient.objects.filter(
+                pk__in={ingredient_id for _, ingredient_id in missing}
+            ).values_list('pk', 'name', 'unit')
+        }
+        ShoppingListItem.objects.bulk_create(
+            ShoppingListItem(
+                user_id=user_id, ingredient_id=ingredient_id,
+                name=ingredients[ingredient_id][0],
+                unit=ingredients[ingredient_id][1],
+                total=max(changes[ingredient_id][0], 0),
+                recipes_count=changes[ingredient_id][1],
+            )
+            for user_id, ingredient_id in missing
+        )
+
+
+def change_recipe_shopping_lists(recipe_id, changes):
+    """
+    Applies the changes to the shopping lists containing the recipe
+    """
+    change_shopping_lists(
+        Purchase.objects.filter(recipe_id=recipe_id).values_list(
+            'user_id', flat=True),
+        changes
+    )
+
+
+SHOPPING_LIST_RECIPES, SHOPPING_LIST_INGREDIENTS = 0, 1
+
+
+def get_shopping_list(user):
+    """
+    Returns the shopping list of the user as one query yielding
+    (section, title, dimension, total, first_unit, last_unit) rows:
+    the names of the purchased recipes followed by the totals of their
+    ingredients taken from the ShoppingListItem rows. The totals are summed
+    up per dimension in its base unit, format_quantity renders them back.
+    """
+    recipes = Recipe.recipes.filter(
+        selected_recipes__user=user
+    ).order_by().annotate(
+        dimension=Value('', CharField()),
+        section=Value(SHOPPING_LIST_RECIPES, IntegerField()),
+        title=F('name'),
+        total=Value(0, IntegerField()),
+        first_unit=Value('', CharField()),
+        last_unit=Value('', CharField()),
+    )
+    ingredients = ShoppingListItem.objects.filter(
+        user=user
+    ).order_by().annotate(
+        dimension=unit_dimension('unit'),
+    ).values('name', 'dimension').annotate(
+        section=Value(SHOPPING_LIST_INGREDIENTS, IntegerField()),
+        title=F('name'),
+        total=Sum(F('total') * unit_factor('unit')),
+        first_unit=Min('unit'),
+        last_unit=Max('unit'),
+    )
+    columns = ('section', 'title', 'dimension', 'total', 'first_unit',
+               'last_unit')
+    return recipes.values_list(*columns).union(
+        ingredients.values_list(*columns), all=True
+    ).order_by('section', 'title', 'dimension')
@@ -1,13 +1,40 @@
+from django.conf import settings
 from django.core.exceptions import ValidationError
+from PIL import Image
 
 
 def image_size_validator(image):
     """
     Validate the maximum size for the image uploaded to the site.
+    The stored images were validated at upload and are not checked again.
     :param image:
     :return:
     """
-    file_size = image.file.size
-    limit_mb = 1
-    if file_size > limit_mb * 1024 * 1024:
+    if getattr(image, '_committed', False):
+        return
+    limit_mb = settings.MAX_IMAGE_UPLOAD_SIZE // (1024 * 1024)
+    if image.size > settings.MAX_IMAGE_UPLOAD_SIZE:
         raise ValidationError('Максимальный размер изображения не должен превышать  %s MB' % limit_mb)
+
+
+def check_image_header(file):
+    """
+    Reads the format and the dimensions from the image header,
+    the pixels are neither decoded nor verified.
+    :param file: file object of the upload
+    :return: Pillow format name
+    """
+    file.seek(0)
+    try:
+        with Image.open(file) as image:
+            image_format, (width, height) = image.format, image.size
+    except Exception:
+        raise ValidationError('Загрузите корректное изображение')
+    finally:
+        file.seek(0)
+    if width * height > settings.MAX_IMAGE_PIXELS:
+        raise ValidationError(
+            'Разрешение изображения не должно превышать %s Мпикс'
+            % (settings.MAX_IMAGE_PIXELS // 1000000)
+        )
+    return image_format
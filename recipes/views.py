@@ -1,22 +1,45 @@
-import csv
 import json
 
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import F, Sum
-from django.http import Http404, HttpResponse, JsonResponse
+from django.core.cache import cache
+from django.core.paginator import InvalidPage
+from django.db import transaction
+from django.http import (Http404, HttpResponse, JsonResponse,
+                         StreamingHttpResponse)
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse, reverse_lazy
+from django.utils.decorators import method_decorator
 from django.views import View
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import etag
 from django.views.generic import (CreateView, DeleteView, DetailView, ListView,
                                   UpdateView)
 
-from recipes.models import Favorite, Follow, Ingredient, Purchase, Recipe, User
+from recipes.models import Favorite, Follow, Purchase, Recipe, User
 
+from .batch import apply_batch
+from .cache import (AnonymousPageCacheMixin, get_catalog_version,
+                    invalidate_id_set)
+from .exports import (EXPORT_FORMATS, get_export_key, get_pdf, iter_cached,
+                      iter_shopping_list, render_json)
+from .feed import (change_followers_count, follow_author, get_feed_queryset,
+                   schedule_fan_out, unfollow_author)
 from .forms import RecipeForm
-from .util import create_ingredients_amounts, get_all_tags, get_filters
-
-
-class RecipeListView(ListView):
+from .paginators import CursorPaginator
+from .search import search_ingredients
+from .uploadhandlers import ImageUploadHandler
+from .util import (change_recipe_counter, change_recipe_shopping_lists,
+                   change_shopping_lists, create_ingredients_amounts,
+                   get_all_tags, get_card_queryset, get_filters,
+                   get_form_ingredients, get_latest_recipes,
+                   get_recipe_shopping_changes, get_viewer_state,
+                   resolve_ingredients, sync_ingredients_amounts)
+
+
+class RecipeListView(AnonymousPageCacheMixin, ListView):
     """
     Main page with recipes
     """
@@ -26,56 +49,108 @@ class RecipeListView(ListView):
     template_name = 'index.html'
     paginate_by = 6
     template_name_field = 'recipes'
+    page_cache_name = 'index'
+
+    def get_page_cache_generations(self):
+        return ['recipes', 'tags']
 
     def get_queryset(self):
         queryset = super().get_queryset()
-        return get_filters(self.request, queryset)
+        return get_card_queryset(get_filters(self.request, queryset))
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Recipe feeds are paginated by the (pub_date, id) keyset
+        """
+        paginator = CursorPaginator(queryset, page_size)
+        try:
+            page = paginator.page(self.request.GET.get('cursor'))
+        except InvalidPage as error:
+            raise Http404(str(error))
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_viewer_authors(self):
+        """
+        Authors shown on the page outside of the recipe cards
+        """
+        return ()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context.update({'all_tags': get_all_tags()})
+        context['viewer_state'] = get_viewer_state(
+            self.request.user, context['object_list'],
+            self.get_viewer_authors()
+        )
         return context
 
 
-class RecipeCreateView(LoginRequiredMixin, CreateView):
+class RecipeFormMixin:
     """
-        Adds a new recipe.
-        After validating the form and creating a new recipe,
-        the author is redirected to the index page.
+    Validates the ingredients of the recipe form
+    and saves the recipe with its ingredients in one transaction.
     """
-    form_class = RecipeForm
-    template_name = 'formCreateChangeRecipe.html'
-    success_url = 'index'
 
-    def form_valid(self, form):
-        instance = form.save(commit=False)
-        instance.author = self.request.user
-        form_data = form.data
-
-        ingredients = [
-            key for key in form_data if key.startswith('nameIngredient_')
-        ]
+    def get_form_amounts(self, form):
+        """
+        Returns {ingredient_id: units} of the form
+        or None after adding the errors to the form.
+        """
+        try:
+            ingredients = get_form_ingredients(form.data)
+        except ValueError:
+            form.add_error(
+                'description',
+                'Количество ингредиента должно быть целым числом'
+            )
+            return None
 
         if not ingredients:
             form.add_error(
                 'description',
                 'Необходимо указать хотя бы один ингредиент для рецепта'
             )
-            return self.form_invalid(form)
+            return None
 
-        ing_name = form_data['nameIngredient_1']
-        ingredients_list = Ingredient.objects.values('name')
-        if not ingredients_list.filter(name=ing_name).exists():
+        ingredient_ids, unknown = resolve_ingredients(ingredients)
+        if unknown:
             form.add_error(
                 'description',
-                'Необходимо выбирать ингредиент из выпадающего списка'
+                'Необходимо выбирать ингредиент из выпадающего списка: '
+                + ', '.join(unknown)
             )
-            return self.form_invalid(form)
-        instance.save()
-        create_ingredients_amounts(instance, form_data)
-        form.save_m2m()
+            return None
+        return {
+            ingredient_ids[name]: units
+            for name, units in ingredients.items()
+        }
 
-        return redirect(self.success_url)
+    def dispatch(self, request, *args, **kwargs):
+        # The handlers can only be replaced before request.POST is read,
+        # so the views are csrf_exempt and the token is checked here
+        request.upload_handlers = [ImageUploadHandler(request)]
+        return csrf_protect(super().dispatch)(request, *args, **kwargs)
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        if 'files' in kwargs:
+            kwargs['upload_errors'] = getattr(
+                self.request, 'upload_errors', {}
+            )
+        return kwargs
+
+    def save_recipe(self, form, instance, amounts):
+        with transaction.atomic():
+            is_new = instance.pk is None
+            instance.save()
+            if is_new:
+                create_ingredients_amounts(instance, amounts)
+                schedule_fan_out(instance.pk)
+            else:
+                change_recipe_shopping_lists(
+                    instance.pk, sync_ingredients_amounts(instance, amounts)
+                )
+            form.save_m2m()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -84,7 +159,31 @@ class RecipeCreateView(LoginRequiredMixin, CreateView):
         return context
 
 
-class RecipeUpdateView(LoginRequiredMixin, UpdateView):
+@method_decorator(csrf_exempt, name='dispatch')
+class RecipeCreateView(LoginRequiredMixin, RecipeFormMixin, CreateView):
+    """
+        Adds a new recipe.
+        After validating the form and creating a new recipe,
+        the author is redirected to the index page.
+    """
+    form_class = RecipeForm
+    template_name = 'formCreateChangeRecipe.html'
+    success_url = 'index'
+
+    def form_valid(self, form):
+        instance = form.save(commit=False)
+        instance.author = self.request.user
+
+        amounts = self.get_form_amounts(form)
+        if amounts is None:
+            return self.form_invalid(form)
+        self.save_recipe(form, instance, amounts)
+
+        return redirect(self.success_url)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class RecipeUpdateView(LoginRequiredMixin, RecipeFormMixin, UpdateView):
     """
     Update recipe
     After validating the form and updating recipe,
@@ -96,20 +195,12 @@ class RecipeUpdateView(LoginRequiredMixin, UpdateView):
 
     def form_valid(self, form):
         instance = form.save(commit=False)
-        form_data = form.data
-        instance.amount_recipes.all().delete()
-        ingredients = [
-            key for key in form_data if key.startswith('nameIngredient_')
-        ]
-        if not ingredients:
-            form.add_error(
-                'description',
-                'Необходимо указать хотя бы один ингредиент для рецепта'
-            )
+
+        amounts = self.get_form_amounts(form)
+        if amounts is None:
             return self.form_invalid(form)
-        instance.save()
-        create_ingredients_amounts(instance, form_data)
-        form.save_m2m()
+        self.save_recipe(form, instance, amounts)
+
         return redirect(self.get_success_url())
 
     def dispatch(self, request, *args, **kwargs):
@@ -126,7 +217,6 @@ class RecipeUpdateView(LoginRequiredMixin, UpdateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context.update({'all_tags': get_all_tags()})
         context.update({'is_edit': True})
 
         return context
@@ -140,6 +230,13 @@ class RecipeDetailView(DetailView):
     template_name = 'recipe.html'
     template_name_field = 'recipe'
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['viewer_state'] = get_viewer_state(
+            self.request.user, [self.object]
+        )
+        return context
+
 
 class RecipeDeleteView(LoginRequiredMixin, DeleteView):
     """
@@ -165,17 +262,23 @@ class AuthorRecipeListView(RecipeListView):
     """
 
     template_name = 'author.html'
+    page_cache_name = 'author'
+
+    def get_page_cache_generations(self):
+        return [f'author:{self.kwargs.get("pk")}', 'tags']
 
     def get_queryset(self):
-        current_user = get_object_or_404(User, pk=self.kwargs.get('pk'))
-        queryset = Recipe.recipes.filter(author=current_user)
+        self.author = get_object_or_404(User, pk=self.kwargs.get('pk'))
+        queryset = Recipe.recipes.filter(author=self.author)
 
-        return get_filters(self.request, queryset)
+        return get_card_queryset(get_filters(self.request, queryset))
+
+    def get_viewer_authors(self):
+        return (self.author,)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        author = get_object_or_404(User, pk=self.kwargs.get('pk'))
-        context['author'] = author
+        context['author'] = self.author
 
         return context
 
@@ -185,31 +288,51 @@ class FavoriteListView(RecipeListView):
     Favorite recipes
     """
     template_name = 'favorite.html'
+    page_cache_name = None
 
     def get_queryset(self):
         author = self.request.user
         queryset = Recipe.recipes.filter(favorite_recipes__user=author).all()
-        return get_filters(self.request, queryset)
+        return get_card_queryset(get_filters(self.request, queryset))
 
 
-class FollowListView(ListView):
+class FeedListView(LoginRequiredMixin, RecipeListView):
+    """
+    Recipes of the followed authors, newest first
+    """
+    template_name = 'feed.html'
+    page_cache_name = None
+
+    def get_queryset(self):
+        queryset = get_feed_queryset(self.request.user)
+        return get_card_queryset(get_filters(self.request, queryset))
+
+
+class FollowListView(LoginRequiredMixin, ListView):
     """
     My subscriptions view
     """
-    model = Recipe
+    context_object_name = 'authors'
+    paginate_by = 6
     template_name = 'subscriptions.html'
+    latest_recipes = 3
+
+    def get_queryset(self):
+        return User.objects.filter(
+            following__user=self.request.user
+        ).order_by('-following__id')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user = self.request.user
-        authors = User.objects.filter(following__user=user)
-        context['authors'] = authors
-        favorite_recipes = {}
+        authors = list(context['authors'])
+        latest = get_latest_recipes(
+            [author.pk for author in authors], self.latest_recipes
+        )
         for author in authors:
-            favorite_recipes[author] = Recipe.recipes.filter(
-                author=author
-            ).order_by('-pub_date')[:3]
-        context['favorite_recipes'] = favorite_recipes
+            author.latest_recipes, author.recipes_count = latest[author.pk]
+            author.more_recipes = author.recipes_count - len(
+                author.latest_recipes)
+        context['authors'] = authors
         return context
 
 
@@ -228,32 +351,42 @@ class PurchaseList(ListView):
         return get_filters(self.request, qs)
 
 
+@login_required
 def purchaselist_download(request):
-    recipes = Recipe.recipes.filter(selected_recipes__user=request.user)
-    ingredients = recipes.annotate(
-        title=F('ingredients__name'),
-        units=F('ingredients__unit')
-    ).values('title', 'ingredients__unit').order_by('title').annotate(
-        total=Sum('amount_recipes__units')
+    """
+    Downloads the shopping list as TXT, JSON or PDF (?format=).
+    The documents are cached until the purchased recipes change.
+    """
+    export_format = request.GET.get('format', 'txt')
+    if export_format not in EXPORT_FORMATS:
+        raise Http404('Неизвестный формат списка покупок')
+    key = get_export_key(request.user, export_format)
+    content = cache.get(key)
+    if content is None and export_format == 'txt':
+        response = StreamingHttpResponse(
+            iter_cached(key, iter_shopping_list(request.user)),
+            content_type=EXPORT_FORMATS[export_format]
+        )
+    else:
+        if content is None and export_format == 'json':
+            content = render_json(request.user)
+            cache.set(key, content, settings.SHOPPING_LIST_CACHE_TIMEOUT)
+        elif content is None:
+            content = get_pdf(request.user, key)
+        if content is None:
+            response = HttpResponse(
+                'Список покупок готовится, повторите загрузку '
+                'через несколько секунд',
+                status=202, content_type='text/plain; charset=utf-8'
+            )
+            response['Retry-After'] = settings.PDF_RENDER_WAIT
+            return response
+        response = HttpResponse(
+            content, content_type=EXPORT_FORMATS[export_format]
+        )
+    response['Content-Disposition'] = (
+        f'attachment; filename="purchaselist.{export_format}"'
     )
-    response = HttpResponse(content_type='text/text')
-    response['Content-Disposition'] = 'attachment; filename="purchaselist.txt"'
-
-    writer = csv.writer(response)
-    writer.writerow([f'Список покупок: {request.user.get_full_name()}'])
-    writer.writerow([])
-    writer.writerow(['Блюда:'])
-    for recipe in recipes:
-        writer.writerow([recipe.name])
-    writer.writerow([])
-    writer.writerow(['Ингредиенты:'])
-    for ingredient in ingredients:
-        if ingredient['title']:
-            name = ingredient['title']
-            dimension = ingredient['ingredients__unit']
-            total = ingredient['total']
-            writer.writerow([f'{name} - {total} {dimension}'])
-
     return response
 
 
@@ -268,10 +401,14 @@ class FavoriteView(View):
         """
         recipe_id = json.loads(request.body).get('id')
         recipe = get_object_or_404(Recipe, id=recipe_id)
-        favorite, created = Favorite.favorite.get_or_create(
-            user=request.user, recipe=recipe
-        )
+        with transaction.atomic():
+            favorite, created = Favorite.favorite.get_or_create(
+                user=request.user, recipe=recipe
+            )
+            if created:
+                change_recipe_counter(recipe.id, 'favorites_count', 1)
         if created:
+            invalidate_id_set(request.user.id, 'favorites')
             return JsonResponse({'success': True})
         return JsonResponse({'success': False})
 
@@ -281,12 +418,14 @@ class FavoriteView(View):
         """
 
         recipe = get_object_or_404(Recipe, id=recipe_id)
-        removed = Favorite.favorite.filter(
-            user=request.user, recipe=recipe
-        ).delete()
-        if removed:
-            return JsonResponse({'success': True})
-        return JsonResponse({'success': False})
+        with transaction.atomic():
+            removed, _ = Favorite.favorite.filter(
+                user=request.user, recipe=recipe
+            ).delete()
+            if removed:
+                change_recipe_counter(recipe.id, 'favorites_count', -removed)
+        invalidate_id_set(request.user.id, 'favorites')
+        return JsonResponse({'success': True})
 
 
 class SubscribeView(View):
@@ -303,10 +442,15 @@ class SubscribeView(View):
         if request.user == author:
             return JsonResponse({'success': False})
 
-        follow, created = Follow.objects.get_or_create(
-            user=request.user, author=author
-        )
+        with transaction.atomic():
+            follow, created = Follow.objects.get_or_create(
+                user=request.user, author=author
+            )
+            if created:
+                change_followers_count(author.id, 1)
+                follow_author(request.user.id, author.id)
         if created:
+            invalidate_id_set(request.user.id, 'following')
             return JsonResponse({'success': True})
         return JsonResponse({'success': False})
 
@@ -316,12 +460,19 @@ class SubscribeView(View):
         """
 
         author = get_object_or_404(User, id=author_id)
-        removed = Follow.objects.filter(
-            user=request.user, author=author
-        ).delete()
-        if removed:
-            return JsonResponse({'success': True})
-        return JsonResponse({'success': False})
+        with transaction.atomic():
+            removed, _ = Follow.objects.filter(
+                user=request.user, author=author
+            ).delete()
+            if removed:
+                change_followers_count(author.id, -removed)
+                unfollow_author(request.user.id, author.id)
+        invalidate_id_set(request.user.id, 'following')
+        return JsonResponse({'success': True})
+
+
+def ingredients_etag(request, *args, **kwargs):
+    return f'ingredients-{get_catalog_version()}'
 
 
 class GetIngredientsView(View):
@@ -329,11 +480,16 @@ class GetIngredientsView(View):
     creates AJAX request for ingredients
     """
 
+    results_limit = 20
+
+    @method_decorator(cache_control(max_age=settings.INGREDIENTS_MAX_AGE))
+    @method_decorator(etag(ingredients_etag))
     def get(self, request):
-        queryset = request.GET.get('query')
-        ingredients = list(Ingredient.objects.filter(
-            name__istartswith=queryset).annotate(
-            title=F('name'), dimension=F('unit')).values('title', 'dimension'))
+        query = request.GET.get('query')
+        ingredients = [
+            {'title': name, 'dimension': unit}
+            for name, unit in search_ingredients(query, self.results_limit)
+        ]
         return JsonResponse(ingredients, safe=False)
 
 
@@ -350,10 +506,17 @@ class PurchasesView(View):
         recipe_id = json.loads(request.body).get('id')
         recipe = get_object_or_404(Recipe, pk=recipe_id)
 
-        purchaselist, created = Purchase.objects.get_or_create(
-            user=request.user, recipe=recipe
-        )
+        with transaction.atomic():
+            purchaselist, created = Purchase.objects.get_or_create(
+                user=request.user, recipe=recipe
+            )
+            if created:
+                change_recipe_counter(recipe.id, 'purchases_count', 1)
+                change_shopping_lists(
+                    [request.user.id], get_recipe_shopping_changes(recipe.id)
+                )
         if created:
+            invalidate_id_set(request.user.id, 'purchases')
             return JsonResponse({'success': True})
         return JsonResponse({'success': False})
 
@@ -362,14 +525,41 @@ class PurchasesView(View):
         Removing a prescription from the shopping list.
         """
 
-        count, _ = Purchase.objects.filter(
-            user=request.user,
-            recipe=recipe_id,
-        ).delete()
-
+        with transaction.atomic():
+            count, _ = Purchase.objects.filter(
+                user=request.user,
+                recipe=recipe_id,
+            ).delete()
+            if count:
+                change_recipe_counter(recipe_id, 'purchases_count', -count)
+                change_shopping_lists(
+                    [request.user.id],
+                    get_recipe_shopping_changes(recipe_id, sign=-1)
+                )
+        invalidate_id_set(request.user.id, 'purchases')
         return JsonResponse({'success': True if count else False})
 
 
+class BatchView(LoginRequiredMixin, View):
+    """
+    Applies a list of add and remove operations on the favorites,
+    purchases and subscriptions in one request
+    """
+
+    def post(self, request):
+        try:
+            operations = json.loads(request.body)['operations']
+        except (ValueError, KeyError, TypeError):
+            operations = None
+        if (not isinstance(operations, list)
+                or len(operations) > settings.BATCH_MAX_OPERATIONS):
+            return JsonResponse({'success': False}, status=400)
+        return JsonResponse({
+            'success': True,
+            'results': apply_batch(request.user, operations),
+        })
+
+
 def page_not_found(request, exception):
     return render(request, 'misc/404.html', {'path': request.path},
                   status=404
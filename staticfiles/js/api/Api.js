@@ -115,6 +115,24 @@ class Api {
             }
             return Promise.reject(e.statusText)
         })
+  }
+  batch (operations) {
+    return fetch(`/batch/`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'X-CSRFToken': document.getElementsByName('csrfmiddlewaretoken')[0].value
+      },
+      body: JSON.stringify({
+        operations: operations
+      })
+    })
+        .then( e => {
+            if(e.ok) {
+                return e.json()
+            }
+            return Promise.reject(e.statusText)
+        })
   }
     getIngredients  (text)  {
         return fetch(`/ingredients?query=${text}`, {
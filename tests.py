@@ -1,10 +1,43 @@
+import csv
+import io
+import json
+import tempfile
+import threading
+import time
+from unittest import mock
+
 import factory
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.template.loader import render_to_string
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import resolve, reverse
+from PIL import Image
+from PIL.ImageFile import ImageFile
 
-from recipes.models import (Amount, Favorite, Follow, Ingredient, Recipe, Tag,
-                            User)
+from api.pagination import ValuesPagination
+from recipes import batch, exports
+from recipes.batch import BATCH_RELATIONS
+from recipes.cache import IdSet, get_page_cache_stats
+from recipes.feed import (backfill_followers, change_followers_count,
+                          fan_out)
+from recipes.images import (generate_variants, get_image_sources,
+                            store_image_variants)
+from recipes.models import (TAG_BITS, Amount, AuthorCounter, Favorite,
+                            FeedEntry, Follow, Ingredient, Purchase, Recipe,
+                            ShoppingListItem, Tag, User)
+from recipes.search import ingredient_index
+from recipes.units import UNITS
+from recipes.util import get_shopping_list, get_viewer_state
+from recipes.views import GetIngredientsView, RecipeListView
 from users.forms import UserCreationForm
 from users.views import SignUp
 
@@ -103,6 +136,12 @@ class UserFactory(factory.Factory):
     first_name = 'Test user first_name'
 
 
+def _verify_shopping_lists(*args):
+    out = io.StringIO()
+    call_command('verify_shopping_lists', *args, stdout=out)
+    return out.getvalue()
+
+
 def _create_user(**kwargs):
     user = UserFactory.create(**kwargs)
     user.save()
@@ -501,3 +540,1620 @@ class TestFavoriteButton(TestCase):
         self.assertFalse(Favorite.favorite.filter(
             recipe=self.recipe, user=self.user).exists(),
                          msg='Должна удаляться соответствующая запись в бд')
+
+
+class TestViewerState(TestCase):
+    """
+    Тесты загрузки состояния кнопок карточек.
+    Проверяет, что избранное, покупки и подписки загружаются фиксированным
+    числом запросов независимо от количества рецептов на странице,
+    а с прогретым кэшем не требуют запросов.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = _create_user()
+        self.author = _create_user(username='Another test user',
+                                   email='another@test.test',
+                                   password='12345Another')
+        tag = Tag.objects.create(name='завтрак', slug='breakfast')
+        for i in range(12):
+            recipe = Recipe.recipes.create(
+                author=self.author, name=f'recipe {i}',
+                description='test', slug='test', cook_time=5)
+            recipe.tag.add(tag)
+        self.recipes = list(Recipe.recipes.all())
+        Favorite.favorite.create(user=self.user, recipe=self.recipes[0])
+        Purchase.objects.create(user=self.user, recipe=self.recipes[1])
+        Follow.objects.create(user=self.user, author=self.author)
+
+    def test_state(self):
+        with self.assertNumQueries(3):
+            state = get_viewer_state(self.user, self.recipes[:2])
+        self.assertEqual(state['favorites'], {self.recipes[0].id})
+        self.assertEqual(state['purchases'], {self.recipes[1].id})
+        self.assertEqual(state['following'], {self.author.id})
+        with self.assertNumQueries(0):
+            get_viewer_state(self.user, self.recipes)
+
+
+def _page_queries(client, url, per_page):
+    """
+    Возвращает SQL запросы, выполненные при отрисовке страницы
+    со списком рецептов при заданном размере страницы.
+    Первый запрос прогревает кэши миниатюр и не учитывается.
+    """
+    with mock.patch.object(RecipeListView, 'paginate_by', per_page):
+        client.get(url)
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(url)
+    return response, [query['sql'] for query in context.captured_queries]
+
+
+class TestListQueryPlan(TestCase):
+    """
+    Тесты плана запросов страниц со списками рецептов.
+    Проверяет, что количество SQL запросов не зависит от размера страницы
+    и что описание рецепта не загружается для карточек.
+    """
+
+    def setUp(self):
+        self.client = Client()
+        self.user = _create_user()
+        self.author = _create_user(username='Another test user',
+                                   email='another@test.test',
+                                   password='12345Another')
+        tags = [Tag.objects.create(name='завтрак', slug='breakfast'),
+                Tag.objects.create(name='обед', slug='lunch')]
+        for i in range(12):
+            recipe = Recipe.recipes.create(
+                author=self.author, name=f'recipe {i}',
+                description='test', slug='test', cook_time=5)
+            recipe.tag.set(tags)
+            Favorite.favorite.create(user=self.user, recipe=recipe)
+
+    def test_queries_per_page(self):
+        self.client.force_login(self.user)
+        urls = [
+            reverse('index'),
+            f'{reverse("index")}?filters=lunch',
+            reverse('author', args=[self.author.id]),
+            reverse('favorites'),
+        ]
+        for url in urls:
+            response, small = _page_queries(self.client, url, 6)
+            self.assertEqual(len(response.context['recipes']), 6)
+            response, large = _page_queries(self.client, url, 12)
+            self.assertEqual(len(response.context['recipes']), 12)
+            self.assertEqual(
+                len(small), len(large),
+                msg=f'Число запросов на {url} зависит от размера страницы')
+            for sql in large:
+                self.assertNotIn(
+                    '"description"', sql,
+                    msg=f'Описание рецепта не должно загружаться на {url}')
+
+
+class TestCursorPagination(TestCase):
+    """
+    Тесты курсорной пагинации ленты рецептов.
+    Проверяет, что переход по курсорам вперед и назад обходит все рецепты
+    без пропусков и что неверный курсор приводит к 404.
+    """
+
+    def setUp(self):
+        self.client = Client()
+        self.user = _create_user()
+        for i in range(15):
+            Recipe.recipes.create(
+                author=self.user, name=f'recipe {i}',
+                description='test', slug='test', cook_time=5)
+
+    def test_walk_pages(self):
+        expected = list(Recipe.recipes.values_list('id', flat=True))
+        seen, pages, url = [], [], reverse('index')
+        while url:
+            response = self.client.get(url)
+            page = response.context['page_obj']
+            ids = [recipe.id for recipe in page]
+            seen.extend(ids)
+            pages.append((ids, page))
+            url = (f'{reverse("index")}?cursor={page.next_cursor}'
+                   if page.has_next() else None)
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(pages), 3)
+        self.assertFalse(pages[0][1].has_previous())
+        response = self.client.get(
+            f'{reverse("index")}?cursor={pages[2][1].previous_cursor}')
+        self.assertEqual(
+            [recipe.id for recipe in response.context['page_obj']],
+            pages[1][0])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(f'{reverse("index")}?cursor=broken')
+        self.assertEqual(response.status_code, 404)
+
+
+class TestTagMask(TestCase):
+    """
+    Тесты битовой маски тегов рецепта.
+    Проверяет синхронизацию маски с тегами рецепта, фильтрацию по маске
+    без JOIN и DISTINCT и команду заполнения маски.
+    """
+
+    def setUp(self):
+        self.client = Client()
+        self.user = _create_user()
+        self.breakfast = Tag.objects.create(name='завтрак', slug='breakfast')
+        self.lunch = Tag.objects.create(name='обед', slug='lunch')
+        self.dinner = Tag.objects.create(name='ужин', slug='dinner')
+        self.recipe = Recipe.recipes.create(
+            author=self.user, name='recipe', description='test',
+            slug='test', cook_time=5)
+
+    def test_sync(self):
+        self.recipe.tag.set([self.breakfast, self.lunch])
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.tag_mask,
+                         self.breakfast.bit | self.lunch.bit)
+        self.recipe.tag.remove(self.breakfast)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.tag_mask, self.lunch.bit)
+        self.dinner.recipe_tags.add(self.recipe)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.tag_mask,
+                         self.lunch.bit | self.dinner.bit)
+        self.lunch.delete()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.tag_mask, self.dinner.bit)
+        self.recipe.tag.clear()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.tag_mask, 0)
+
+    def test_filter(self):
+        self.recipe.tag.set([self.breakfast, self.lunch])
+        other = Recipe.recipes.create(
+            author=self.user, name='other', description='test',
+            slug='test', cook_time=5)
+        other.tag.add(self.dinner)
+        self.client.force_login(self.user)
+        response, queries = _page_queries(
+            self.client,
+            f'{reverse("index")}?filters=lunch&filters=breakfast', 6)
+        self.assertEqual(list(response.context['recipes']), [self.recipe])
+        recipe_query = [sql for sql in queries
+                        if sql.startswith('SELECT "recipes_recipe"."id"')][0]
+        self.assertNotIn('recipes_recipe_tag', recipe_query)
+        self.assertNotIn('DISTINCT', recipe_query)
+        self.assertEqual(
+            list(Recipe.recipes.filter_by_tags('ужин')), [other])
+
+    def test_bit_positions(self):
+        self.lunch.delete()
+        supper = Tag.objects.create(pk=1000, name='полдник', slug='supper')
+        self.assertEqual(
+            supper.bit_position, 1,
+            msg='Новый тег получает освободившийся бит, а не бит по id')
+        self.recipe.tag.set([supper])
+        self.assertEqual(list(Recipe.recipes.filter_by_tags('полдник')),
+                         [self.recipe])
+        Tag.objects.bulk_create([
+            Tag(name=f'тег {position}', slug=f'tag{position}',
+                bit_position=position) for position in range(3, TAG_BITS)
+        ])
+        with self.assertRaises(ValidationError):
+            Tag.objects.create(name='лишний', slug='extra')
+        with self.assertRaises(ValidationError):
+            Tag(name='лишний', slug='extra').full_clean()
+
+    def test_backfill(self):
+        self.recipe.tag.set([self.lunch])
+        Recipe.recipes.update(tag_mask=0)
+        call_command('backfill_tag_mask', stdout=mock.MagicMock())
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.tag_mask, self.lunch.bit)
+
+
+class TestRecipeCardCache(TestCase):
+    """
+    Тесты кэша карточек рецептов.
+    Проверяет, что повторная отрисовка карточки не выполняет запросов и что
+    карточка обновляется при изменении рецепта, его тегов и имени автора.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = _create_user()
+        self.tag = Tag.objects.create(name='завтрак', slug='breakfast')
+        self.lunch = Tag.objects.create(name='обед', slug='lunch')
+        self.recipe = Recipe.recipes.create(
+            author=self.user, name='Old name', description='test',
+            slug='test', cook_time=5)
+        self.recipe.tag.add(self.tag)
+
+    def _render(self):
+        recipe = Recipe.recipes.get(pk=self.recipe.pk)
+        return render_to_string('includes/recipe_card.html',
+                                {'recipe': recipe})
+
+    def test_cache_hit(self):
+        first = self._render()
+        recipe = Recipe.recipes.get(pk=self.recipe.pk)
+        with self.assertNumQueries(0):
+            second = render_to_string('includes/recipe_card.html',
+                                      {'recipe': recipe})
+        self.assertEqual(first, second)
+
+    def test_save_queries(self):
+        self.recipe.refresh_from_db()
+        version = self.recipe.card_version
+        with self.assertNumQueries(1):
+            self.recipe.save()
+        self.assertEqual(self.recipe.card_version, version + 1,
+                         msg='Версия читается из базы при обращении')
+
+    def test_invalidation(self):
+        self.assertIn('Old name', self._render())
+        self.recipe.name = 'New name'
+        self.recipe.save()
+        self.assertIn('New name', self._render())
+        self.recipe.tag.add(self.lunch)
+        self.assertIn('badge_style_green', self._render())
+        self.user.first_name = 'Renamed'
+        self.user.save()
+        self.assertIn('Renamed', self._render())
+
+
+class TestAnonymousPageCache(TransactionTestCase):
+    """
+    Тесты кэша страниц для неавторизованных пользователей.
+    Проверяет, что повторный запрос главной страницы и страницы автора
+    не обращается к базе данных, отдает те же заголовки и что кэш
+    сбрасывается после фиксации изменений рецептов и тегов.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = _create_user()
+        self.tag = Tag.objects.create(name='завтрак', slug='breakfast')
+        self.recipe = Recipe.recipes.create(
+            author=self.user, name='First recipe', description='test',
+            slug='test', cook_time=5)
+        self.recipe.tag.add(self.tag)
+
+    def _check_cache(self):
+        urls = [
+            reverse('index'),
+            f'{reverse("index")}?filters=breakfast',
+            reverse('author', args=[self.user.id]),
+        ]
+        for url in urls:
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual(first.content, second.content)
+            self.assertEqual(dict(first.items()), dict(second.items()),
+                             msg='Заголовки страницы сохраняются в кэше')
+
+        Recipe.recipes.create(
+            author=self.user, name='Second recipe', description='test',
+            slug='test', cook_time=5)
+        for url in urls[::2]:
+            self.assertIn('Second recipe', self.client.get(url).content.decode())
+
+        self.tag.name = 'бранч'
+        self.tag.save()
+        for url in urls:
+            self.assertIn('бранч', self.client.get(url).content.decode())
+
+    def test_locmem(self):
+        self._check_cache()
+        stats = get_page_cache_stats()
+        self.assertGreater(stats['hits'], 0)
+        self.assertGreater(stats['misses'], 0)
+
+    def test_filebased(self):
+        with tempfile.TemporaryDirectory() as location:
+            caches = {'default': {
+                'BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location,
+            }}
+            with override_settings(CACHES=caches):
+                self._check_cache()
+
+    def test_invalidate_on_commit(self):
+        self.client.get(reverse('index'))
+        with transaction.atomic():
+            Recipe.recipes.create(
+                author=self.user, name='Second recipe', description='test',
+                slug='test', cook_time=5)
+            response = self.client.get(reverse('index'))
+            self.assertNotIn('Second recipe', response.content.decode(),
+                             msg='Кэш не сбрасывается до фиксации')
+        response = self.client.get(reverse('index'))
+        self.assertIn('Second recipe', response.content.decode())
+
+    def test_filters_key(self):
+        self.client.get(reverse('index'), {'filters': 'breakfast'})
+        with self.assertNumQueries(0):
+            self.client.get(reverse('index'),
+                            {'filters': ['breakfast', 'x' * 500, 'breakfast']})
+        self.assertEqual(get_page_cache_stats()['misses'], 1,
+                         msg='Неизвестные теги создают новые записи кэша')
+
+    def test_auth_user_bypass(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('index'))
+        response = self.client.get(reverse('index'))
+        self.assertIn('Создать рецепт', response.content.decode())
+        self.assertEqual(get_page_cache_stats(), {'hits': 0, 'misses': 0})
+
+
+class TestCounters(TestCase):
+    """
+    Тесты денормализованных счетчиков.
+    Проверяет изменение счетчиков избранного, покупок и подписчиков при
+    добавлении и удалении записей и их исправление командой сверки.
+    """
+
+    def setUp(self):
+        self.client = Client()
+        self.user = _create_user()
+        self.author = _create_user(username='Another test user',
+                                   email='another@test.test',
+                                   password='12345Another')
+        self.recipe = Recipe.recipes.create(
+            author=self.author, name='recipe', description='test',
+            slug='test', cook_time=5)
+        self.client.force_login(self.user)
+
+    def _post(self, name, obj_id):
+        self.client.post(reverse(name), data={'id': obj_id},
+                         content_type='application/json')
+
+    def test_views(self):
+        self._post('add_favorite', self.recipe.id)
+        self._post('add_favorite', self.recipe.id)
+        self._post('add-purchases', self.recipe.id)
+        self._post('add_subscription', self.author.id)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertEqual(self.recipe.purchases_count, 1)
+        self.assertEqual(self.author.counter.followers_count, 1)
+
+        self.client.delete(reverse('remove_favorites', args=[self.recipe.id]))
+        self.client.delete(reverse('remove_favorites', args=[self.recipe.id]))
+        self.client.delete(reverse('remove_purchases', args=[self.recipe.id]))
+        self.client.delete(
+            reverse('remove_subscriptions', args=[self.author.id]))
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+        self.assertEqual(self.recipe.purchases_count, 0)
+        self.author.counter.refresh_from_db()
+        self.assertEqual(self.author.counter.followers_count, 0)
+
+    def test_missed_rows(self):
+        Favorite.favorite.create(user=self.user, recipe=self.recipe)
+        Follow.objects.create(user=self.user, author=self.author)
+        self.client.delete(reverse('remove_favorites', args=[self.recipe.id]))
+        self.client.delete(
+            reverse('remove_subscriptions', args=[self.author.id]))
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+        self.assertEqual(
+            AuthorCounter.objects.get(author=self.author).followers_count, 0)
+
+    def test_reconcile(self):
+        Favorite.favorite.create(user=self.user, recipe=self.recipe)
+        Purchase.objects.create(user=self.user, recipe=self.recipe)
+        Follow.objects.create(user=self.user, author=self.author)
+        AuthorCounter.objects.create(author=self.user, followers_count=5)
+        call_command('reconcile_counters', stdout=mock.MagicMock())
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertEqual(self.recipe.purchases_count, 1)
+        self.assertEqual(
+            AuthorCounter.objects.get(author=self.author).followers_count, 1)
+        self.assertEqual(
+            AuthorCounter.objects.get(author=self.user).followers_count, 0)
+
+
+class TestPurchasesCounter(TransactionTestCase):
+    """
+    Тесты счетчика списка покупок в шапке страницы.
+    Проверяет, что счетчик обновляется при добавлении и удалении покупок
+    и что с прогретым кэшем он не обращается к базе данных.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = _create_user()
+        self.recipe = Recipe.recipes.create(
+            author=self.user, name='recipe', description='test',
+            slug='test', cook_time=5)
+        self.client.force_login(self.user)
+
+    def _counter(self):
+        response = self.client.get(reverse('purchaselist'))
+        return response.content.decode().split('id="counter">')[1].split(
+            '</span>')[0].strip()
+
+    def test_write_through(self):
+        self.assertEqual(self._counter(), '')
+        self.client.post(reverse('add-purchases'),
+                         data={'id': self.recipe.id},
+                         content_type='application/json')
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self._counter(), '1')
+        self.assertFalse(
+            [query for query in context.captured_queries
+             if query['sql'].startswith('SELECT COUNT(*)')],
+            msg='Счетчик покупок не должен запрашиваться из базы')
+        self.client.delete(reverse('remove_purchases', args=[self.recipe.id]))
+        self.assertEqual(self._counter(), '')
+
+
+def _load_ingredients():
+    with open('recipes/fixtures/ingredients.csv') as isfile:
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, unit=unit)
+            for name, unit in csv.reader(isfile)
+        )
+    ingredient_index.invalidate()
+
+
+class TestIngredientIndex(TransactionTestCase):
+    """
+    Тесты автодополнения ингредиентов.
+    Проверяет поиск по префиксу без учета регистра кириллицы, ограничение
+    числа результатов, перестроение индекса после фиксации изменений
+    ингредиентов и скорость поиска по всему справочнику.
+    """
+
+    def setUp(self):
+        _load_ingredients()
+
+    def _search(self, query):
+        response = self.client.get(reverse('get_ingredients'),
+                                   {'query': query})
+        return response.json()
+
+    def test_prefix(self):
+        results = self._search('АБРИКОС')
+        self.assertIn({'title': 'абрикосы', 'dimension': 'г'}, results)
+        self.assertTrue(all(item['title'].startswith('абрикос')
+                            for item in results))
+        self.assertEqual(
+            len(self._search('а')), GetIngredientsView.results_limit)
+        self.assertEqual(self._search(''), [])
+        self.assertEqual(self.client.get(
+            reverse('get_ingredients')).json(), [])
+
+    def test_rebuild(self):
+        item = {'title': 'Ёжевика', 'dimension': 'г'}
+        self.assertNotIn(item, self._search('ёжевика'))
+        ingredient = Ingredient.objects.create(name='Ёжевика', unit='г')
+        self.assertEqual(self._search('ЁЖ')[0], item)
+        ingredient.delete()
+        self.assertNotIn(item, self._search('ёж'))
+
+    def test_rebuild_on_commit(self):
+        self._search('ёж')
+        with transaction.atomic():
+            Ingredient.objects.create(name='Ёжевика', unit='г')
+            self.assertEqual(self._search('ёж'), [],
+                             msg='Индекс перестроен до фиксации')
+        self.assertEqual(self._search('ёж')[0]['title'], 'Ёжевика')
+
+    def test_load_product_data(self):
+        count = Ingredient.objects.count()
+        with mock.patch('recipes.management.commands.load_product_data.'
+                        'invalidate_catalog') as invalidate:
+            call_command('load_product_data')
+        invalidate.assert_called_once_with()
+        self.assertEqual(Ingredient.objects.count(), count)
+
+    def test_latency(self):
+        ingredient_index.search('а', 1)
+        queries = ['а', 'бан', 'сыр', 'мол', 'кар', 'я']
+        start = time.perf_counter()
+        for i in range(1000):
+            ingredient_index.search(queries[i % len(queries)], 20)
+        average = (time.perf_counter() - start) / 1000
+        self.assertLess(average, 0.001)
+
+    def test_typo(self):
+        results = self._search('кортофель')
+        self.assertEqual(results[0], {'title': 'картофель', 'dimension': 'г'})
+        self.assertEqual(self._search('пармезн')[0]['title'], 'пармезан')
+        self.assertEqual(self._search('zzzz'), [])
+
+    def test_conditional_response(self):
+        url = f'{reverse("get_ingredients")}?query=абрикос'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('max-age=', response['Cache-Control'])
+        etag = response['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        Ingredient.objects.create(name='абрикосовый соус', unit='г')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn({'title': 'абрикосовый соус', 'dimension': 'г'},
+                      response.json())
+
+
+class TestRecipeSave(TestCase):
+    """
+    Тесты сохранения рецепта.
+    Проверяет, что ингредиенты формы разрешаются одним запросом,
+    что все неизвестные ингредиенты попадают в ошибку формы и что рецепт
+    с ошибкой не сохраняется.
+    """
+
+    def setUp(self):
+        self.client = Client()
+        self.user = _create_user()
+        self.client.force_login(self.user)
+        self.tag = Tag.objects.create(name='завтрак', slug='breakfast')
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ingredient {i}', unit='г') for i in range(30))
+
+    def _data(self, names):
+        data = {'name': 'Recipe', 'description': 'test', 'cook_time': 10,
+                'tag': [self.tag.id]}
+        for i, name in enumerate(names, start=1):
+            data[f'nameIngredient_{i}'] = name
+            data[f'valueIngredient_{i}'] = str(i)
+            data[f'unitsIngredient_{i}'] = 'г'
+        return data
+
+    def test_create(self):
+        names = [f'ingredient {i}' for i in range(30)]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('new_recipe'),
+                                        self._data(names))
+        self.assertEqual(response.status_code, 302)
+        ingredient_queries = [
+            query for query in context.captured_queries
+            if query['sql'].startswith('SELECT')
+            and 'FROM "recipes_ingredient"' in query['sql']]
+        self.assertEqual(len(ingredient_queries), 1)
+        recipe = Recipe.recipes.get()
+        self.assertEqual(recipe.amount_recipes.count(), 30)
+        self.assertEqual(list(recipe.tag.all()), [self.tag])
+
+    def test_unknown_ingredients(self):
+        names = ['ingredient 1', 'unknown 1', 'unknown 2']
+        response = self.client.post(reverse('new_recipe'), self._data(names))
+        self.assertEqual(response.status_code, 200)
+        errors = response.context['form'].errors['description'][0]
+        self.assertIn('unknown 1', errors)
+        self.assertIn('unknown 2', errors)
+        self.assertFalse(Recipe.recipes.exists())
+        self.assertFalse(Amount.objects.exists())
+
+
+class TestRecipeEdit(TestCase):
+    """
+    Тесты редактирования рецепта.
+    Проверяет, что при изменении рецепта пишутся только изменившиеся
+    количества ингредиентов, а нетронутые строки остаются на месте.
+    """
+
+    def setUp(self):
+        self.client = Client()
+        self.user = _create_user()
+        self.client.force_login(self.user)
+        self.tag = Tag.objects.create(name='завтрак', slug='breakfast')
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ingredient {i}', unit='г') for i in range(5))
+
+    def _data(self, amounts, description='test'):
+        data = {'name': 'Recipe', 'description': description,
+                'cook_time': 10, 'tag': [self.tag.id]}
+        for i, (name, value) in enumerate(amounts.items(), start=1):
+            data[f'nameIngredient_{i}'] = name
+            data[f'valueIngredient_{i}'] = str(value)
+            data[f'unitsIngredient_{i}'] = 'г'
+        return data
+
+    def _edit(self, recipe, data):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(
+                reverse('edit_recipe', args=[recipe.id]), data)
+        self.assertEqual(response.status_code, 302)
+        return [query['sql'] for query in context.captured_queries
+                if '"recipes_amount"' in query['sql']
+                and not query['sql'].startswith('SELECT')]
+
+    def test_edit(self):
+        amounts = {'ingredient 0': 1, 'ingredient 1': 2, 'ingredient 2': 3}
+        self.client.post(reverse('new_recipe'), self._data(amounts))
+        recipe = Recipe.recipes.get()
+        untouched = recipe.amount_recipes.get(ingredient__name='ingredient 0')
+
+        writes = self._edit(recipe, self._data(amounts, 'changed'))
+        self.assertEqual(writes, [], msg='Изменилось только описание, '
+                                         'но ингредиенты перезаписаны')
+
+        writes = self._edit(recipe, self._data(
+            {'ingredient 0': 1, 'ingredient 1': 5, 'ingredient 3': 4}))
+        self.assertEqual(len(writes), 3)
+        self.assertEqual(
+            dict(recipe.amount_recipes.values_list('ingredient__name',
+                                                   'units')),
+            {'ingredient 0': 1, 'ingredient 1': 5, 'ingredient 3': 4})
+        self.assertTrue(Amount.objects.filter(pk=untouched.pk).exists(),
+                        msg='Неизменившаяся строка пересоздана')
+
+
+class TestImageVariants(TestCase):
+    """
+    Тесты подготовленных размеров изображений рецепта.
+    Проверяет, что сохранение рецепта ставит генерацию в очередь,
+    что для каждого размера строится лестница ширин в WebP и в исходном
+    формате и что шаблоны переходят с оригинала на srcset.
+    """
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        buffer = io.BytesIO()
+        Image.effect_noise((800, 600), 64).convert('RGB').save(buffer, 'JPEG')
+        self.user = _create_user()
+        with mock.patch('recipes.signals.schedule_image_variants') as task:
+            self.recipe = Recipe.recipes.create(
+                author=self.user, name='recipe', description='test',
+                slug='test', cook_time=5,
+                image=SimpleUploadedFile('dish.jpg', buffer.getvalue()))
+        task.assert_called_once_with(self.recipe.image.name)
+
+    def test_default_image(self):
+        with mock.patch('recipes.signals.schedule_image_variants') as task:
+            Recipe.recipes.create(author=self.user, name='default',
+                                  description='test', cook_time=5)
+        task.assert_not_called()
+
+    def test_generate(self):
+        name = self.recipe.image.name
+        html = render_to_string('includes/recipe_image.html',
+                                get_image_sources(self.recipe, 'card'))
+        self.assertNotIn('srcset', html)
+
+        manifest, generated = generate_variants(name)
+        self.assertEqual(generate_variants(name), (manifest, []))
+        # the 800x600 original is too small for the 2x detail image
+        self.assertEqual(
+            {variant: [width for width, *_ in ladder]
+             for variant, ladder in manifest['variants'].items()},
+            {'card': [360, 540, 720], 'detail': [480],
+             'small': [90, 135, 180]})
+        self.assertEqual(len(generated), 14)
+        for ladder in manifest['variants'].values():
+            for width, webp, fallback in ladder:
+                with default_storage.open(webp) as file:
+                    image = Image.open(file)
+                    self.assertEqual((image.format, image.width),
+                                     ('WEBP', width))
+                with default_storage.open(fallback) as file:
+                    self.assertEqual(Image.open(file).format, 'JPEG')
+
+        store_image_variants(name, manifest)
+        self.recipe.refresh_from_db()
+        html = render_to_string('includes/recipe_image.html',
+                                get_image_sources(self.recipe, 'card'))
+        self.assertIn('type="image/webp"', html)
+        self.assertIn('_card_720.webp 720w', html)
+        self.assertIn('sizes="(max-width: 363px) 100vw, 363px"', html)
+
+    def test_backfill(self):
+        version = self.recipe.card_version
+        call_command('backfill_image_variants', stdout=io.StringIO())
+        self.recipe.refresh_from_db()
+        self.assertGreater(self.recipe.card_version, version,
+                           msg='Карточка рецепта не сброшена из кеша')
+        self.assertEqual(self.recipe.image_variants['source'],
+                         self.recipe.image.name)
+        out = io.StringIO()
+        call_command('image_variants_report', stdout=out)
+        self.assertIn('images without variants: 0', out.getvalue())
+
+
+class TestImageUpload(TestCase):
+    """
+    Тесты загрузки изображения рецепта.
+    Проверяет, что слишком большой файл отбрасывается еще при чтении
+    запроса, что размеры изображения проверяются по заголовку и что
+    корректное изображение сохраняется.
+    """
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = Client()
+        self.client.force_login(_create_user())
+        self.tag = Tag.objects.create(name='завтрак', slug='breakfast')
+        Ingredient.objects.create(name='ingredient', unit='г')
+
+    def _post(self, content, name='dish.png'):
+        image = SimpleUploadedFile(name, content)
+        return self.client.post(reverse('new_recipe'), {
+            'name': 'Recipe', 'description': 'test', 'cook_time': 10,
+            'tag': [self.tag.id], 'image': image,
+            'nameIngredient_1': 'ingredient', 'valueIngredient_1': '1',
+            'unitsIngredient_1': 'г'})
+
+    def _image(self, size):
+        buffer = io.BytesIO()
+        Image.effect_noise(size, 64).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    @override_settings(MAX_IMAGE_UPLOAD_SIZE=10 * 1024)
+    def test_too_large(self):
+        received = []
+        receive = TemporaryFileUploadHandler.receive_data_chunk
+
+        def spy(handler, raw_data, start):
+            received.append(len(raw_data))
+            return receive(handler, raw_data, start)
+
+        with mock.patch.object(TemporaryFileUploadHandler,
+                               'receive_data_chunk', spy):
+            response = self._post(self._image((400, 400)))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('image', response.context['form'].errors)
+        self.assertLessEqual(sum(received), 10 * 1024,
+                             msg='Файл записан сверх ограничения')
+        self.assertFalse(Recipe.recipes.exists())
+
+    @override_settings(MAX_IMAGE_PIXELS=100)
+    def test_dimensions(self):
+        content = self._image((20, 20))
+        with mock.patch.object(ImageFile, 'load') as load:
+            response = self._post(content)
+        load.assert_not_called()
+        self.assertIn('image', response.context['form'].errors)
+        self.assertFalse(Recipe.recipes.exists())
+
+    def test_invalid_image(self):
+        response = self._post(b'not an image')
+        self.assertIn('image', response.context['form'].errors)
+
+    def test_csrf(self):
+        self.client.handler.enforce_csrf_checks = True
+        response = self._post(self._image((40, 30)))
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Recipe.recipes.exists())
+
+    def test_upload(self):
+        response = self._post(self._image((40, 30)))
+        self.assertEqual(response.status_code, 302)
+        recipe = Recipe.recipes.get()
+        with default_storage.open(recipe.image.name) as file:
+            self.assertEqual(Image.open(file).size, (40, 30))
+
+
+class TestShoppingListExport(TestCase):
+    """
+    Тесты выгрузки списка покупок.
+    Проверяет, что список отдается потоком, собирается одним запросом
+    и что одинаковые ингредиенты разных рецептов суммируются.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = _create_user(first_name='Иван', last_name='Петров')
+        self.client.force_login(self.user)
+        flour = Ingredient.objects.create(name='мука', unit='г')
+        egg = Ingredient.objects.create(name='яйцо', unit='шт.')
+        for name, amounts in (('блины', {flour: 200, egg: 2}),
+                              ('оладьи', {flour: 150, egg: 1}),
+                              ('сырники', {egg: 1})):
+            recipe = Recipe.recipes.create(
+                author=self.user, name=name, description='test',
+                slug='test', cook_time=5)
+            Amount.objects.bulk_create(
+                Amount(recipe=recipe, ingredient=ingredient, units=units)
+                for ingredient, units in amounts.items())
+            if name != 'сырники':
+                self.client.post(reverse('add-purchases'),
+                                 data={'id': recipe.id},
+                                 content_type='application/json')
+
+    def test_download(self):
+        response = self.client.get(reverse('purchaselist_download'))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'],
+                         'text/plain; charset=utf-8')
+        with CaptureQueriesContext(connection) as context:
+            content = b''.join(response.streaming_content).decode()
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(content.splitlines(), [
+            'Список покупок: Иван Петров', '',
+            'Блюда:', 'блины', 'оладьи', '',
+            'Ингредиенты:', 'мука - 350 г', 'яйцо - 3 шт.'])
+
+    def test_admin_amount_change(self):
+        key = exports.get_export_key(self.user, 'txt')
+        b''.join(self.client.get(
+            reverse('purchaselist_download')).streaming_content)
+        amount = Amount.objects.get(recipe__name='блины',
+                                    ingredient__name='мука')
+        admin = Client()
+        admin.force_login(User.objects.create_superuser(
+            'admin', 'admin@test.test', '12345Admin'))
+        version = amount.recipe.card_version
+        response = admin.post(
+            reverse('admin:recipes_amount_change', args=[amount.pk]),
+            {'recipe': amount.recipe_id, 'ingredient': amount.ingredient_id,
+             'units': 300})
+        self.assertEqual(response.status_code, 302)
+        self.assertNotEqual(exports.get_export_key(self.user, 'txt'), key,
+                            msg='Ключ выгрузки не изменился')
+        amount.recipe.refresh_from_db()
+        self.assertEqual(amount.recipe.card_version, version + 1)
+        content = b''.join(self.client.get(
+            reverse('purchaselist_download')).streaming_content).decode()
+        self.assertIn('мука - 450 г', content.splitlines(),
+                      msg='Список покупок не пересчитан')
+
+    def test_empty(self):
+        for recipe in Recipe.recipes.all():
+            self.client.delete(reverse('remove_purchases', args=[recipe.id]))
+        response = self.client.get(reverse('purchaselist_download'))
+        content = b''.join(response.streaming_content).decode()
+        self.assertEqual(content.splitlines()[1:],
+                         ['', 'Блюда:', '', 'Ингредиенты:'])
+
+
+class TestShoppingListUnits(TestCase):
+    """
+    Тесты приведения единиц измерения в списке покупок.
+    Проверяет, что реестр покрывает все единицы каталога ингредиентов,
+    что количество в каждой единице выводится как есть и что количества
+    одного продукта в разных единицах одной размерности складываются.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = _create_user()
+        self.client.force_login(self.user)
+
+    def _shopping_list(self, amounts):
+        recipe = Recipe.recipes.create(
+            author=self.user, name='recipe', description='test',
+            slug='test', cook_time=5)
+        Amount.objects.bulk_create(
+            Amount(recipe=recipe, units=units,
+                   ingredient=Ingredient.objects.get_or_create(
+                       name=name, unit=unit)[0])
+            for name, unit, units in amounts)
+        self.client.post(reverse('add-purchases'),
+                         data={'id': recipe.id},
+                         content_type='application/json')
+        response = self.client.get(reverse('purchaselist_download'))
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        return lines[lines.index('Ингредиенты:') + 1:]
+
+    def test_vocabulary(self):
+        with open('recipes/fixtures/ingredients.csv') as file:
+            units = sorted({unit for _, unit in csv.reader(file)})
+        self.assertEqual(set(units) - set(UNITS), set(),
+                         msg='Единицы каталога отсутствуют в реестре')
+        lines = self._shopping_list(
+            (f'product {i:02}', unit, 3) for i, unit in enumerate(units))
+        expected = [
+            f'product {i:02} - ' + ('по вкусу' if unit == 'по вкусу'
+                                    else f'3 {unit}'.rstrip())
+            for i, unit in enumerate(units)]
+        self.assertEqual(lines, expected)
+
+    def test_conversion(self):
+        lines = self._shopping_list([
+            ('мука', 'г', 500), ('мука', 'кг', 1),
+            ('молоко', 'ст. л.', 2), ('молоко', 'ч. л.', 1),
+            ('вода', 'стакан', 4), ('вода', 'л', 1), ('вода', 'мл', 50),
+            ('сахар', 'г', 30), ('сахар', 'ст. л.', 1),
+            ('соль', 'по вкусу', 0), ('соль', 'г', 5),
+            ('яйцо', 'шт.', 2), ('яйцо', 'г', 60),
+        ])
+        self.assertEqual(lines, [
+            'вода - 1,85 л',
+            'молоко - 35 мл',
+            'мука - 1,5 кг',
+            'сахар - 30 г',
+            'сахар - 1 ст. л.',
+            'соль - 5 г',
+            'соль - по вкусу',
+            'яйцо - 60 г',
+            'яйцо - 2 шт.',
+        ])
+
+
+class TestShoppingListFormats(TestCase):
+    """
+    Тесты форматов и кеширования выгрузки списка покупок.
+    Проверяет, что повторная выгрузка берется из кеша без обращения
+    к ингредиентам, что изменение рецепта сбрасывает кеш и что PDF
+    готовится вне запроса.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = _create_user()
+        self.client.force_login(self.user)
+        self.recipe = Recipe.recipes.create(
+            author=self.user, name='блины', description='test',
+            slug='test', cook_time=5)
+        Amount.objects.create(
+            recipe=self.recipe, units=200,
+            ingredient=Ingredient.objects.create(name='мука', unit='г'))
+        self.client.post(reverse('add-purchases'),
+                         data={'id': self.recipe.id},
+                         content_type='application/json')
+
+    def _download(self, export_format='txt'):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                reverse('purchaselist_download'), {'format': export_format})
+            if response.streaming:
+                content = b''.join(response.streaming_content)
+            else:
+                content = response.content
+        ingredient_queries = [
+            query['sql'] for query in context.captured_queries
+            if '"recipes_amount"' in query['sql']
+            or '"recipes_ingredient"' in query['sql']
+            or '"recipes_shoppinglistitem"' in query['sql']]
+        return response, content, ingredient_queries
+
+    def test_cached(self):
+        response, content, queries = self._download()
+        self.assertTrue(response.streaming)
+        self.assertEqual(len(queries), 1)
+        response, cached, queries = self._download()
+        self.assertEqual(cached, content)
+        self.assertEqual(queries, [], msg='Повторная выгрузка не из кеша')
+
+        self.recipe.name = 'оладьи'
+        self.recipe.save()
+        response, content, queries = self._download()
+        self.assertEqual(len(queries), 1)
+        self.assertIn('оладьи', content.decode())
+
+    def test_json(self):
+        response, content, _ = self._download('json')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(content)['ingredients'],
+                         [{'name': 'мука', 'quantity': '200 г'}])
+        _, _, queries = self._download('json')
+        self.assertEqual(queries, [])
+
+    def test_unknown_format(self):
+        response, _, _ = self._download('docx')
+        self.assertEqual(response.status_code, 404)
+
+    def test_pdf(self):
+        response, content, _ = self._download('pdf')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(content.startswith(b'%PDF'))
+
+    @override_settings(PDF_FONT='/nonexistent/font.ttf')
+    def test_missing_font(self):
+        with self.assertRaises(ImproperlyConfigured):
+            exports.render_pdf(['Список покупок'])
+
+    @override_settings(PDF_RENDER_WAIT=0.01)
+    def test_slow_pdf(self):
+        rendered = threading.Event()
+        render_pdf = exports.render_pdf
+
+        def slow_render(lines):
+            rendered.wait(5)
+            return render_pdf(lines)
+
+        with mock.patch('recipes.exports.render_pdf', slow_render):
+            response, _, _ = self._download('pdf')
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(self._download('pdf')[0].status_code, 202)
+            rendered.set()
+            for _ in range(100):
+                if cache.get(exports.get_export_key(self.user, 'pdf')):
+                    break
+                time.sleep(0.05)
+        response, content, queries = self._download('pdf')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(content.startswith(b'%PDF'))
+        self.assertEqual(queries, [])
+
+
+class TestShoppingListAggregate(TestCase):
+    """
+    Тесты материализованного списка покупок.
+    Проверяет, что строки списка обновляются при добавлении и удалении
+    покупок, при изменении и удалении рецепта, что чтение списка
+    не делает JOIN и что команда проверки находит и чинит расхождения.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = _create_user()
+        self.client.force_login(self.user)
+        self.tag = Tag.objects.create(name='завтрак', slug='breakfast')
+        for name in ('мука', 'яйцо', 'молоко'):
+            Ingredient.objects.create(name=name, unit='г')
+        for name, amounts in (('блины', {'мука': 200, 'яйцо': 2}),
+                              ('оладьи', {'мука': 150, 'молоко': 100})):
+            self.client.post(reverse('new_recipe'), self._data(name, amounts))
+        self.pancakes, self.fritters = Recipe.recipes.order_by('pk')
+
+    def _data(self, name, amounts):
+        data = {'name': name, 'description': 'test', 'cook_time': 10,
+                'tag': [self.tag.id]}
+        for i, (ingredient, units) in enumerate(amounts.items(), start=1):
+            data[f'nameIngredient_{i}'] = ingredient
+            data[f'valueIngredient_{i}'] = str(units)
+            data[f'unitsIngredient_{i}'] = 'г'
+        return data
+
+    def _purchase(self, recipe):
+        self.client.post(reverse('add-purchases'), data={'id': recipe.id},
+                         content_type='application/json')
+
+    def _items(self):
+        return dict(ShoppingListItem.objects.filter(
+            user=self.user).values_list('name', 'total'))
+
+    def _verify(self, *args):
+        return _verify_shopping_lists(*args)
+
+    def test_purchases(self):
+        self._purchase(self.pancakes)
+        self._purchase(self.fritters)
+        self.assertEqual(self._items(),
+                         {'мука': 350, 'яйцо': 2, 'молоко': 100})
+        self.client.delete(
+            reverse('remove_purchases', args=[self.pancakes.id]))
+        self.assertEqual(self._items(), {'мука': 150, 'молоко': 100})
+
+        with CaptureQueriesContext(connection) as context:
+            list(get_shopping_list(self.user))
+        self.assertEqual(len(context.captured_queries), 1)
+        ingredients_sql = context.captured_queries[0]['sql'].split(
+            'UNION ALL')[1]
+        self.assertNotIn('JOIN', ingredients_sql)
+        self.assertIn('0 lists differ', self._verify())
+
+    def test_recipe_changes(self):
+        self._purchase(self.pancakes)
+        self._purchase(self.fritters)
+        self.client.post(reverse('edit_recipe', args=[self.pancakes.id]),
+                         self._data('блины', {'мука': 300, 'молоко': 50}))
+        self.assertEqual(self._items(), {'мука': 450, 'молоко': 150})
+        self.fritters.delete()
+        self.assertEqual(self._items(), {'мука': 300, 'молоко': 50})
+        self.assertIn('0 lists differ', self._verify())
+
+    def test_verify(self):
+        self._purchase(self.pancakes)
+        ShoppingListItem.objects.filter(name='мука').update(total=1)
+        self.assertIn('1 lists differ', self._verify())
+        self.assertIn('rebuilt', self._verify('--fix'))
+        self.assertEqual(self._items(), {'мука': 200, 'яйцо': 2})
+
+
+class TestSubscriptionsPage(TestCase):
+    """
+    Тесты постраничной страницы подписок.
+    Проверяет, что авторы разбиты на страницы, что у каждого автора
+    показаны три последних рецепта и число остальных, и что количество
+    запросов не зависит от числа авторов на странице.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = _create_user()
+        self.client.force_login(self.user)
+        self.authors = []
+        for number in range(8):
+            author = _create_user(username=f'author{number}',
+                                  email=f'author{number}@test.test',
+                                  first_name=f'Автор{number}')
+            for recipe in range(number):
+                Recipe.recipes.create(
+                    author=author, name=f'Рецепт {number}.{recipe}',
+                    description='test', cook_time=5,
+                    image='static/images/testCardImg.png'
+                )
+            Follow.objects.create(user=self.user, author=author)
+            self.authors.append(author)
+
+    def _page(self, page=1):
+        return self.client.get(reverse('subscriptions'), {'page': page})
+
+    def test_pages(self):
+        first, second = self._page(), self._page(2)
+        self.assertEqual(
+            [author.pk for author in first.context['authors']],
+            [author.pk for author in self.authors[:1:-1]],
+            msg='На первой странице шесть последних подписок')
+        self.assertEqual(
+            [author.pk for author in second.context['authors']],
+            [author.pk for author in self.authors[1::-1]],
+            msg='На второй странице остальные подписки')
+
+    def test_latest_recipes(self):
+        authors = {author.first_name: author
+                   for author in self._page().context['authors']}
+        author = authors['Автор5']
+        self.assertEqual(
+            [recipe.name for recipe in author.latest_recipes],
+            ['Рецепт 5.4', 'Рецепт 5.3', 'Рецепт 5.2'],
+            msg='У автора показаны три последних рецепта')
+        self.assertEqual((author.recipes_count, author.more_recipes), (5, 2))
+        self.assertContains(self._page(), 'Еще рецептов: 2')
+        self.assertEqual(authors['Автор2'].more_recipes, 0)
+        self.assertEqual(
+            self._page(2).context['authors'][1].latest_recipes, [],
+            msg='У автора без рецептов список рецептов пуст')
+
+    def test_queries(self):
+        self._page()
+        with CaptureQueriesContext(connection) as few:
+            self._page(2)
+        with CaptureQueriesContext(connection) as many:
+            self._page()
+        self.assertEqual(
+            len(few.captured_queries), len(many.captured_queries),
+            msg='Число запросов не зависит от числа авторов на странице')
+        recipe_queries = [
+            query for query in many.captured_queries
+            if 'FROM "recipes_recipe"' in query['sql']
+            and 'ROW_NUMBER' not in query['sql']
+        ]
+        self.assertEqual(recipe_queries, [],
+                         msg='Рецепты читаются одним запросом с ROW_NUMBER')
+
+
+class TestFeed(TestCase):
+    """
+    Тесты ленты подписок.
+    Проверяет, что новый рецепт попадает в ленты подписчиков автора,
+    что рецепты авторов с большим числом подписчиков читаются без записей
+    в ленте, что подписка и отписка меняют ленту и что число запросов
+    страницы ленты не зависит от числа авторов.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = _create_user()
+        self.client.force_login(self.user)
+        self.tag = Tag.objects.create(name='завтрак', slug='breakfast')
+        Ingredient.objects.create(name='мука', unit='г')
+        self.authors = [
+            _create_user(username=f'author{number}',
+                         email=f'author{number}@test.test',
+                         first_name=f'Автор{number}')
+            for number in range(3)
+        ]
+        for author in self.authors[:2]:
+            self._follow(author)
+
+    def _follow(self, author):
+        self.client.post(reverse('add_subscription'), data={'id': author.id},
+                         content_type='application/json')
+
+    def _publish(self, author, name):
+        client = Client()
+        client.force_login(author)
+        with mock.patch('recipes.views.schedule_fan_out',
+                        side_effect=fan_out):
+            client.post(reverse('new_recipe'), {
+                'name': name, 'description': 'test', 'cook_time': 10,
+                'tag': [self.tag.id], 'nameIngredient_1': 'мука',
+                'valueIngredient_1': '100', 'unitsIngredient_1': 'г',
+            })
+        return Recipe.recipes.get(name=name)
+
+    def _feed(self, **params):
+        response = self.client.get(reverse('feed'), params)
+        return [recipe.name for recipe in response.context['object_list']]
+
+    def test_fan_out(self):
+        self._publish(self.authors[0], 'блины')
+        self._publish(self.authors[2], 'оладьи')
+        self._publish(self.authors[1], 'сырники')
+        self.assertEqual(self._feed(), ['сырники', 'блины'],
+                         msg='В ленте только рецепты авторов из подписок')
+        self.assertEqual(FeedEntry.objects.filter(user=self.user).count(), 2)
+
+    @override_settings(FEED_PUSH_LIMIT=0)
+    def test_pull(self):
+        self._publish(self.authors[0], 'блины')
+        self.assertFalse(FeedEntry.objects.exists(),
+                         msg='Рецепты популярных авторов не копируются')
+        self.assertEqual(self._feed(), ['блины'])
+
+    @override_settings(FEED_PUSH_LIMIT=1)
+    def test_demoted_author(self):
+        follower = _create_user(username='follower', email='f@test.test')
+        Follow.objects.create(user=follower, author=self.authors[0])
+        change_followers_count(self.authors[0].id, 1)
+        self._publish(self.authors[0], 'блины')
+        self.assertFalse(FeedEntry.objects.exists())
+
+        client = Client()
+        client.force_login(follower)
+        with mock.patch('recipes.feed.schedule_backfill',
+                        side_effect=backfill_followers) as backfill:
+            client.delete(
+                reverse('remove_subscriptions', args=[self.authors[0].id]))
+        backfill.assert_called_once_with([self.authors[0].id])
+        self.assertEqual(self._feed(), ['блины'],
+                         msg='Рецепты автора пропали из ленты')
+        self.assertTrue(FeedEntry.objects.filter(user=self.user).exists())
+
+    def test_follow(self):
+        self._publish(self.authors[2], 'оладьи')
+        self._follow(self.authors[2])
+        self.assertEqual(self._feed(), ['оладьи'],
+                         msg='Подписка добавляет рецепты автора в ленту')
+        self.client.delete(
+            reverse('remove_subscriptions', args=[self.authors[2].id]))
+        self.assertEqual(self._feed(), [],
+                         msg='Отписка убирает рецепты автора из ленты')
+
+    @override_settings(FEED_BATCH_SIZE=1)
+    def test_pages(self):
+        for number in range(8):
+            self._publish(self.authors[number % 2], f'рецепт {number}')
+        self._feed()
+        with CaptureQueriesContext(connection) as first:
+            response = self.client.get(reverse('feed'))
+        names = [recipe.name for recipe in response.context['object_list']]
+        self.assertEqual(names, [f'рецепт {number}'
+                                 for number in range(7, 1, -1)])
+        cursor = response.context['page_obj'].next_cursor
+        with CaptureQueriesContext(connection) as second:
+            self.assertEqual(self._feed(cursor=cursor),
+                             ['рецепт 1', 'рецепт 0'])
+        self.assertEqual(len(first.captured_queries),
+                         len(second.captured_queries),
+                         msg='Число запросов ленты постоянно')
+
+    def test_backfill(self):
+        self._publish(self.authors[0], 'блины')
+        FeedEntry.objects.all().delete()
+        call_command('backfill_feed', stdout=io.StringIO())
+        self.assertEqual(self._feed(), ['блины'])
+
+
+class TestIdSets(TestCase):
+    """
+    Тесты кэша избранного, покупок и подписок пользователя.
+    Проверяет, что кэш загружается одним запросом, что представления
+    сбрасывают его при изменениях и что get_favorites возвращает QuerySet
+    всех рецептов из избранного.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = _create_user()
+        self.author = _create_user(username='Another test user',
+                                   email='another@test.test',
+                                   first_name='Автор')
+        self.client.force_login(self.user)
+        self.recipes = [
+            Recipe.recipes.create(author=self.author, name=f'recipe {i}',
+                                  description='test', cook_time=5)
+            for i in range(3)
+        ]
+
+    def _post(self, name, pk):
+        self.client.post(reverse(name), data={'id': pk},
+                         content_type='application/json')
+
+    def test_id_set(self):
+        id_set = IdSet([5, 1, 3, 3])
+        self.assertEqual(list(id_set), [1, 3, 5])
+        self.assertIn(3, id_set)
+        self.assertNotIn(4, id_set)
+        self.assertEqual(list(IdSet.from_bytes(id_set.to_bytes())),
+                         [1, 3, 5])
+
+    def test_invalidation(self):
+        with self.assertNumQueries(3):
+            get_viewer_state(self.user, self.recipes)
+        with self.assertNumQueries(0):
+            get_viewer_state(self.user, self.recipes)
+        for recipe in self.recipes[:2]:
+            self._post('add_favorite', recipe.id)
+        self._post('add-purchases', self.recipes[2].id)
+        self._post('add_subscription', self.author.id)
+        self.client.delete(
+            reverse('remove_favorites', args=[self.recipes[0].id]))
+        with self.assertNumQueries(3):
+            state = get_viewer_state(self.user, self.recipes)
+        self.assertEqual(state, {
+            'favorites': {self.recipes[1].id},
+            'purchases': {self.recipes[2].id},
+            'following': {self.author.id},
+        })
+        self.client.delete(
+            reverse('remove_subscriptions', args=[self.author.id]))
+        self.client.delete(
+            reverse('remove_purchases', args=[self.recipes[2].id]))
+        state = get_viewer_state(self.user, self.recipes)
+        self.assertEqual((state['purchases'], state['following']),
+                         (set(), set()))
+
+    def test_get_favorites(self):
+        for recipe in self.recipes[:2]:
+            self._post('add_favorite', recipe.id)
+        favorites = Favorite.favorite.get_favorites(self.user)
+        self.assertEqual(
+            set(favorites.values_list('pk', flat=True)),
+            {recipe.id for recipe in self.recipes[:2]},
+            msg='get_favorites возвращает все рецепты из избранного')
+        self.assertFalse(Favorite.favorite.get_favorites(self.author).exists())
+
+
+class TestBatchEndpoint(TestCase):
+    """
+    Тесты пакетного изменения избранного, покупок и подписок.
+    Проверяет результаты по каждой операции, счетчики, список покупок
+    и кэш пользователя, а также что число запросов не зависит от числа
+    операций в пакете.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = _create_user()
+        self.client.force_login(self.user)
+        self.authors = [
+            _create_user(username=f'author{number}',
+                         email=f'author{number}@test.test')
+            for number in range(3)
+        ]
+        flour = Ingredient.objects.create(name='мука', unit='г')
+        self.recipes = []
+        for number in range(6):
+            recipe = Recipe.recipes.create(
+                author=self.authors[number % 3], name=f'recipe {number}',
+                description='test', cook_time=5)
+            Amount.objects.create(recipe=recipe, ingredient=flour, units=100)
+            self.recipes.append(recipe)
+
+    def _batch(self, operations):
+        response = self.client.post(
+            reverse('batch'), data={'operations': operations},
+            content_type='application/json')
+        return response
+
+    def _operations(self, relation, action, objects):
+        return [{'relation': relation, 'action': action, 'id': obj.id}
+                for obj in objects]
+
+    def test_results(self):
+        get_viewer_state(self.user, self.recipes)
+        response = self._batch([
+            {'relation': 'favorites', 'action': 'add',
+             'id': self.recipes[0].id},
+            {'relation': 'favorites', 'action': 'add',
+             'id': self.recipes[0].id},
+            {'relation': 'purchases', 'action': 'add',
+             'id': self.recipes[1].id},
+            {'relation': 'purchases', 'action': 'remove',
+             'id': self.recipes[2].id},
+            {'relation': 'subscriptions', 'action': 'add',
+             'id': self.authors[0].id},
+            {'relation': 'subscriptions', 'action': 'add',
+             'id': self.user.id},
+            {'relation': 'favorites', 'action': 'add', 'id': 0},
+            {'relation': 'likes', 'action': 'add', 'id': 1},
+        ])
+        results = response.json()['results']
+        self.assertEqual(
+            [result['success'] for result in results],
+            [True, False, True, False, True, False, False, False],
+            msg='Результат возвращается для каждой операции')
+        self.assertEqual(results[6]['error'], 'Объект не найден')
+        self.assertEqual(results[7]['error'], 'Неверная операция')
+
+        self.recipes[0].refresh_from_db()
+        self.recipes[1].refresh_from_db()
+        self.assertEqual(self.recipes[0].favorites_count, 1)
+        self.assertEqual(self.recipes[1].purchases_count, 1)
+        self.assertEqual(AuthorCounter.objects.get(
+            author=self.authors[0]).followers_count, 1)
+        self.assertEqual(dict(ShoppingListItem.objects.filter(
+            user=self.user).values_list('name', 'total')), {'мука': 100})
+        self.assertIn(self.recipes[0].id,
+                      FeedEntry.objects.filter(user=self.user).values_list(
+                          'recipe_id', flat=True))
+        state = get_viewer_state(self.user, self.recipes)
+        self.assertEqual(state, {
+            'favorites': {self.recipes[0].id},
+            'purchases': {self.recipes[1].id},
+            'following': {self.authors[0].id},
+        })
+
+    def test_concurrent_add(self):
+        apply_changes = batch._apply_changes
+
+        def add_concurrently(user, relation, added, removed):
+            for pk in added:
+                BATCH_RELATIONS[relation][0].create(
+                    user=user, **{BATCH_RELATIONS[relation][1]: pk})
+            return apply_changes(user, relation, added, removed)
+
+        with mock.patch('recipes.batch._apply_changes',
+                        side_effect=add_concurrently):
+            self._batch(self._operations('favorites', 'add', self.recipes[:1])
+                        + self._operations('purchases', 'add',
+                                           self.recipes[1:2]))
+        self.recipes[0].refresh_from_db()
+        self.recipes[1].refresh_from_db()
+        self.assertEqual(
+            (self.recipes[0].favorites_count, self.recipes[1].purchases_count),
+            (0, 0), msg='Строки, добавленные другим запросом, учтены дважды')
+        self.assertEqual(Purchase.objects.filter(user=self.user).count(), 1,
+                         msg='Покупка добавлена дважды')
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+    def test_remove(self):
+        self._batch(self._operations('purchases', 'add', self.recipes)
+                    + self._operations('subscriptions', 'add', self.authors))
+        response = self._batch(
+            self._operations('purchases', 'remove', self.recipes[:4])
+            + self._operations('subscriptions', 'remove', self.authors[:2]))
+        self.assertTrue(all(result['success']
+                            for result in response.json()['results']))
+        self.assertEqual(
+            set(Purchase.objects.filter(user=self.user).values_list(
+                'recipe_id', flat=True)),
+            {recipe.id for recipe in self.recipes[4:]})
+        self.assertEqual(dict(ShoppingListItem.objects.filter(
+            user=self.user).values_list('total', 'recipes_count')),
+            {200: 2})
+        self.assertEqual(
+            list(Follow.objects.filter(user=self.user).values_list(
+                'author_id', flat=True)), [self.authors[2].id])
+        self.assertIn('0 lists differ', _verify_shopping_lists())
+
+    def test_queries(self):
+        with CaptureQueriesContext(connection) as few:
+            self._batch(self._operations('favorites', 'add',
+                                         self.recipes[:2]))
+        with CaptureQueriesContext(connection) as many:
+            self._batch(self._operations('favorites', 'add',
+                                         self.recipes[2:]))
+        self.assertEqual(len(few.captured_queries),
+                         len(many.captured_queries),
+                         msg='Число запросов не зависит от размера пакета')
+
+    def test_invalid(self):
+        self.assertEqual(self._batch('add').status_code, 400)
+        with override_settings(BATCH_MAX_OPERATIONS=2):
+            response = self._batch(
+                self._operations('favorites', 'add', self.recipes[:3]))
+        self.assertEqual(response.status_code, 400)
+
+
+class TestReadApi(TestCase):
+    """
+    Тесты JSON API для чтения рецептов, тегов, ингредиентов и авторов.
+    Проверяет постраничный вывод, выбор полей через fields=, подгрузку
+    ингредиентов через include=, фильтр по тегам и что число запросов
+    не зависит от числа рецептов на странице.
+    """
+
+    def setUp(self):
+        self.client = Client()
+        self.author = _create_user(first_name='Автор')
+        self.breakfast = Tag.objects.create(name='завтрак', slug='breakfast')
+        self.lunch = Tag.objects.create(name='обед', slug='lunch')
+        flour = Ingredient.objects.create(name='мука', unit='г')
+        self.recipes = []
+        for number in range(8):
+            recipe = Recipe.recipes.create(
+                author=self.author, name=f'recipe {number}',
+                description='test', cook_time=5,
+                image='static/images/testCardImg.png')
+            recipe.tag.add(self.breakfast if number % 2 else self.lunch)
+            Amount.objects.create(recipe=recipe, ingredient=flour,
+                                  units=number + 1)
+            self.recipes.append(recipe)
+
+    def _get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_recipes(self):
+        data = self._get('/api/v1/recipes/')
+        self.assertEqual(data['count'], 8)
+        self.assertEqual(len(data['results']), 6,
+                         msg='Размер страницы берется из REST_FRAMEWORK')
+        first = data['results'][0]
+        self.assertEqual(first['id'], self.recipes[-1].id)
+        self.assertEqual(first['tags'], ['breakfast'])
+        self.assertEqual(first['author'], self.author.id)
+        self.assertTrue(first['image'].endswith('testCardImg.png'))
+        self.assertNotIn('ingredients', first)
+
+        data = self._get(f'/api/v1/recipes/{self.recipes[0].id}/',
+                         fields='name', include='ingredients')
+        self.assertEqual(data, {
+            'id': self.recipes[0].id, 'name': 'recipe 0',
+            'ingredients': [{'name': 'мука', 'unit': 'г', 'amount': 1}],
+        })
+        self.assertEqual(
+            self.client.get('/api/v1/recipes/0/').status_code, 404)
+
+    def test_filters(self):
+        data = self._get('/api/v1/recipes/', filters='lunch', limit=10,
+                         fields='tags')
+        self.assertEqual(data['count'], 4)
+        self.assertTrue(all(item['tags'] == ['lunch']
+                            for item in data['results']))
+        self.assertEqual(
+            self.client.get('/api/v1/recipes/', {'fields': 'tag_mask'}
+                            ).status_code, 400,
+            msg='Неизвестное поле возвращает ошибку')
+
+    def test_max_limit(self):
+        with mock.patch.object(ValuesPagination, 'max_limit', 5):
+            data = self._get('/api/v1/recipes/', limit=1000)
+        self.assertEqual(len(data['results']), 5,
+                         msg='Размер страницы не превышает max_limit')
+
+    def test_queries(self):
+        with CaptureQueriesContext(connection) as few:
+            self._get('/api/v1/recipes/', limit=2, include='ingredients')
+        with CaptureQueriesContext(connection) as many:
+            self._get('/api/v1/recipes/', limit=8, include='ingredients')
+        self.assertEqual(len(few.captured_queries),
+                         len(many.captured_queries),
+                         msg='Число запросов не зависит от размера страницы')
+
+    def test_catalogs(self):
+        self.assertEqual(
+            self._get('/api/v1/tags/'),
+            [{'id': self.breakfast.id, 'name': 'завтрак',
+              'slug': 'breakfast'},
+             {'id': self.lunch.id, 'name': 'обед', 'slug': 'lunch'}])
+        self.assertEqual(self._get('/api/v1/ingredients/')['results'],
+                         [{'id': Ingredient.objects.get().id,
+                           'name': 'мука', 'unit': 'г'}])
+        _create_user(username='reader', email='reader@test.test')
+        authors = self._get('/api/v1/authors/', fields='first_name')
+        self.assertEqual(authors['results'],
+                         [{'id': self.author.id, 'first_name': 'Автор'}],
+                         msg='В списке авторов только пользователи с рецептами')
+
+    def test_benchmark(self):
+        out = io.StringIO()
+        call_command('benchmark_api_serialization', repeat=1, stdout=out)
+        self.assertIn('values:', out.getvalue())
+        self.assertIn('ModelSerializer:', out.getvalue())